@@ -26,6 +26,7 @@
 import argparse
 import logging
 import os
+import shutil
 import subprocess
 import sys
 
@@ -40,6 +41,32 @@ else:
 logger = logging.getLogger('run-in-sysroot')
 
 
+def add_bind(argv, bound, path):
+    # type: (typing.List[str], typing.List[str], str) -> None
+    """
+    Append --bind path path to argv, unless path is one of bound or
+    inside one of them, in which case bwrap would already make it
+    visible.
+    """
+    path = os.path.normpath(path)
+
+    for parent in bound:
+        if path == parent:
+            return
+
+        if (
+            path.startswith(parent.rstrip('/') + '/')
+            and os.path.realpath(path) == os.path.join(
+                os.path.realpath(parent),
+                os.path.relpath(path, parent),
+            )
+        ):
+            return
+
+    bound.append(path)
+    argv.extend(['--bind', path, path])
+
+
 def main():
     # type: () -> int
 
@@ -74,14 +101,20 @@ def main():
             return 1
 
         os.makedirs(abs_sysroot, exist_ok=True)
-        subprocess.check_call([
+        tar = [
             'tar',
-            '-xvf',
+            '-xf',
             args.tarball,
             '--exclude=./dev/*',
             '--exclude=dev/*',
             '-C', abs_sysroot,
-        ])
+        ]
+
+        # pigz decompresses faster than gzip, if it's available
+        if args.tarball.endswith('.gz') and shutil.which('pigz'):
+            tar.append('--use-compress-program=pigz')
+
+        subprocess.check_call(tar)
 
     os.makedirs(os.path.join(abs_sysroot, 'tmp'), exist_ok=True)
     os.makedirs(os.path.join(abs_sysroot, 'home'), exist_ok=True)
@@ -113,10 +146,11 @@ def main():
         '--tmpfs', '/home',
         '--tmpfs', '/run',
         '--tmpfs', '/run/host',
-        '--bind', abs_srcdir, abs_srcdir,
-        '--bind', real_builddir, real_builddir,
         '--setenv', 'PATH', '/usr/lib/ccache:/usr/local/bin:/usr/bin:/bin',
     ]
+    bound = []      # type: typing.List[str]
+    add_bind(argv, bound, abs_srcdir)
+    add_bind(argv, bound, real_builddir)
 
     if (
         real_builddir != abs_builddir
@@ -134,15 +168,10 @@ def main():
         'PRESSURE_VESSEL_TEST_CONTAINERS',
     ):
         if var in os.environ:
-            val = os.environ[var]
-            argv.extend([
-                '--bind', val, val,
-            ])
+            add_bind(argv, bound, os.environ[var])
 
     for rw in args.rw:
-        argv.extend([
-            '--bind', rw, rw,
-        ])
+        add_bind(argv, bound, rw)
 
     argv.extend([
         '--chdir', os.getcwd(),
@@ -151,7 +180,16 @@ def main():
     ])
     argv.extend(args.args)
 
-    os.execvp('bwrap', argv)
+    # shutil.which() only needs to stat() each directory in PATH, whereas
+    # os.execvp() would try to execve() each one in turn
+    bwrap = shutil.which('bwrap')
+
+    if bwrap is None:
+        # Not in PATH: let execvp() fail in the usual way, rather than
+        # os.execv() running ./bwrap from the current directory
+        os.execvp('bwrap', argv)
+    else:
+        os.execv(bwrap, argv)
 
 
 if __name__ == '__main__':
@@ -24,8 +24,11 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import argparse
+import concurrent.futures
 import contextlib
+import fcntl
 import hashlib
+import json
 import logging
 import os
 import shlex
@@ -43,6 +46,111 @@ logger = logging.getLogger('pressure-vessel.deploy')
 
 COMMAND = typing.Union[str, typing.List[str]]
 
+REMOTE_PREAMBLE = textwrap.dedent('''\
+    set -eu;
+    umask 0022;
+''')
+
+# Size of the buffer used when copying or hashing files
+BLOCK_SIZE = 1024 * 1024
+
+# Number of sha256sum processes to run in parallel on the server
+VERIFY_JOBS = 4
+
+# Only in fcntl since Python 3.10
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+
+
+def copy_and_hash(
+    reader: typing.IO[bytes],
+    writer: typing.IO[bytes],
+) -> str:
+    '''
+    Copy reader into writer, returning the SHA256 of the copied data.
+    '''
+    hasher = hashlib.sha256()
+    buf = memoryview(bytearray(BLOCK_SIZE))
+
+    while True:
+        n = reader.readinto(buf)    # type: ignore
+
+        if not n:
+            break
+
+        hasher.update(buf[:n])
+        writer.write(buf[:n])
+
+    return hasher.hexdigest()
+
+
+def hash_file(path: Path) -> str:
+    with open(str(path), 'rb', buffering=0) as reader:
+        # Most files are small enough to hash in one go, without
+        # needing a buffer or a loop
+        if os.fstat(reader.fileno()).st_size < BLOCK_SIZE:
+            return hashlib.sha256(reader.readall()).hexdigest()
+
+        hasher = hashlib.sha256()
+        buf = memoryview(bytearray(BLOCK_SIZE))
+
+        while True:
+            n = reader.readinto(buf)
+
+            if not n:
+                break
+
+            hasher.update(buf[:n])
+
+    return hasher.hexdigest()
+
+
+class HashCache:
+    '''
+    Remember the SHA256 of files across runs, so that large files that
+    are hard-linked into the upload directory unchanged (in particular
+    pressure-vessel-bin.tar.gz) do not need to be read again.
+
+    Files are identified by device, inode, size and modification time.
+    The inode change time is not included, because it changes every time
+    we hard-link the file into the upload directory.
+    '''
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.cached = {}    # type: typing.Dict[str, str]
+        self.used = {}      # type: typing.Dict[str, str]
+
+        try:
+            with open(str(path)) as reader:
+                self.cached = json.load(reader)
+        except (OSError, ValueError) as e:
+            logger.debug('Not using cached hashes from %s: %s', path, e)
+
+    def hash_file(self, path: Path) -> str:
+        stat_info = os.stat(str(path))
+        key = '{} {} {} {}'.format(
+            stat_info.st_dev,
+            stat_info.st_ino,
+            stat_info.st_size,
+            stat_info.st_mtime_ns,
+        )
+        digest = self.cached.get(key)
+
+        if digest is None:
+            digest = hash_file(path)
+
+        # Only keep entries for files that are still in use, so that the
+        # cache does not grow without limit
+        self.used[key] = digest
+        return digest
+
+    def save(self) -> None:
+        with open(str(self.path) + '.new', 'w') as writer:
+            json.dump(self.used, writer, indent=2, sort_keys=True)
+            writer.write('\n')
+
+        os.replace(str(self.path) + '.new', str(self.path))
+
 
 @contextlib.contextmanager
 def RemoteTemporaryDirectory(
@@ -78,8 +186,16 @@ def SshMaster(
 
     env = dict(os.environ)
 
+    # Only the master needs keepalives: if it survives a brief network
+    # interruption, the connections multiplexed over it do too
     process = subprocess.Popen(
-        ssh + ['-M', 'cat'],
+        ssh[:-1] + [
+            '-M',
+            '-oServerAliveInterval=30',
+            '-oServerAliveCountMax=6',
+            ssh[-1],
+            'cat',
+        ],
         env=env,
         stdin=subprocess.PIPE,
         stdout=subprocess.DEVNULL,
@@ -111,6 +227,9 @@ class Uploader:
         self.dbgsym_path = dbgsym_path
         self.login = login
         self.dry_run = dry_run
+        self.remote_preamble_chdir = REMOTE_PREAMBLE + 'cd {};\n'.format(
+            shlex.quote(self.basedir),
+        )
 
         self.ssh_target = '{}@{}'.format(self.login, self.host)
         self.ssh_known_hosts = ssh_known_hosts
@@ -119,6 +238,7 @@ class Uploader:
         self.stack = contextlib.ExitStack()
         self.local_tmpdir = None    # type: typing.Optional[str]
         self.ssh = ['false']        # type: typing.List[str]
+        self.rsync_rsh = 'false'
         self.remote_tmpdir = None   # type: typing.Optional[str]
 
     def __enter__(self) -> 'Uploader':
@@ -128,6 +248,8 @@ class Uploader:
         assert self.local_tmpdir is not None
         self.ssh = [
             'ssh',
+            # Almost everything we upload is already compressed
+            '-oCompression=no',
             '-oControlPath={}/socket'.format(self.local_tmpdir),
         ]
 
@@ -137,6 +259,11 @@ class Uploader:
         if self.ssh_private_key is not None:
             self.ssh.extend(['-i', self.ssh_private_key])
 
+        # rsync gets the same ssh options minus the target, so that it
+        # attaches to the persistent connection via the ControlPath
+        # instead of doing its own TCP connection and key exchange
+        self.rsync_rsh = ' '.join(map(shlex.quote, self.ssh))
+
         self.ssh.append(self.ssh_target)
         self.stack.enter_context(SshMaster(self.ssh))
         self.remote_tmpdir = self.stack.enter_context(
@@ -153,13 +280,10 @@ class Uploader:
         chdir=True,
         shell=False,
     ) -> str:
-        preamble = textwrap.dedent('''\
-            set -eu;
-            umask 0022;
-        ''')
-
         if chdir:
-            preamble = preamble + 'cd {};\n'.format(shlex.quote(self.basedir))
+            preamble = self.remote_preamble_chdir
+        else:
+            preamble = REMOTE_PREAMBLE
 
         if shell:
             assert isinstance(command, str)
@@ -211,6 +335,100 @@ class Uploader:
             self.remote_command(command, chdir=chdir, shell=shell),
         ], **kwargs)
 
+    def run_local_commands(
+        self,
+        commands: typing.List[typing.List[str]],
+    ) -> None:
+        for argv in commands:
+            if self.dry_run:
+                logger.info('Would run: %r', argv)
+            else:
+                logger.info('%r', argv)
+                subprocess.check_call(argv)
+
+    def upload_with_tar(
+        self,
+        source: Path,
+        dest: str,
+    ) -> None:
+        argv = [
+            'tar',
+            '-C', str(source),
+            '--mode=a+rX,og-w',
+            '-cf', '-',
+            '.',
+        ]
+        # Apply the modes from the archive exactly, as rsync --perms
+        # would, instead of masking them with the remote user's umask
+        remote_argv = [
+            'tar',
+            '-C', dest,
+            '--no-same-owner',
+            '--same-permissions',
+            '-xf', '-',
+        ]
+
+        if self.dry_run:
+            logger.info('Would run: %r | remote: %r', argv, remote_argv)
+            return
+
+        logger.info('%r | remote: %r', argv, remote_argv)
+
+        with subprocess.Popen(argv, stdout=subprocess.PIPE) as tar:
+            assert tar.stdout is not None
+
+            # Use a larger pipe buffer than the default 64 KiB, to reduce
+            # the number of context switches between tar and ssh. This
+            # is only an optimization, so ignore failure.
+            with contextlib.suppress(OSError):
+                fcntl.fcntl(tar.stdout, F_SETPIPE_SZ, 1024 * 1024)
+
+            self.check_call(remote_argv, stdin=tar.stdout)
+
+        if tar.returncode != 0:
+            raise subprocess.CalledProcessError(tar.returncode, argv)
+
+    def verify_sha256sums(
+        self,
+        sha256sums: Path,
+        remote_dir: str,
+    ) -> None:
+        '''
+        Check the uploaded files against sha256sums, split into
+        VERIFY_JOBS parallel sha256sum processes on the server.
+        '''
+        assert self.local_tmpdir is not None
+
+        with open(str(sha256sums)) as reader:
+            lines = reader.readlines()
+
+        shards = []     # type: typing.List[str]
+
+        for i in range(min(VERIFY_JOBS, len(lines))):
+            shard = os.path.join(
+                self.local_tmpdir, 'SHA256SUMS.{}'.format(i),
+            )
+
+            with open(shard, 'w') as writer:
+                writer.writelines(lines[i::VERIFY_JOBS])
+
+            shards.append(shard)
+
+        def verify(shard: str) -> None:
+            with open(shard) as reader:
+                self.check_call([
+                    'env', '--chdir', '{}'.format(remote_dir),
+                    'sha256sum', '--strict', '--quiet', '-c',
+                ], stdin=reader)
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=VERIFY_JOBS,
+        ) as executor:
+            for future in [
+                executor.submit(verify, shard) for shard in shards
+            ]:
+                future.result()
+
     def run(self):
         with self:
             self.check_call([
@@ -236,26 +454,38 @@ class Uploader:
         sources = Path('_build', 'upload', 'sources')
         sources.mkdir()
 
+        dsc_files = []      # type: typing.List[str]
+
         for a in Path('debian', 'tmp', 'artifacts', 'build').iterdir():
             if str(a).endswith('.dsc'):
-                # Use dcmd to also link all the files that make up the
-                # source package
-                subprocess.check_call([
-                    'dcmd', 'ln', str(a), str(sources),
-                ])
+                dsc_files.append(str(a))
             elif str(a).endswith(('.deb', '.ddeb')):
                 os.link(str(a), str(packages / a.name))
 
                 if '_all.' not in a.name:
                     os.link(str(a), str(dbgsym / a.name))
 
+        if dsc_files:
+            # Use dcmd to also link all the files that make up the
+            # source packages, expanding all of them in a single call
+            subprocess.check_call(
+                ['dcmd', 'ln'] + sorted(dsc_files) + [str(sources)]
+            )
+
         a = Path('_build', 'production', 'pressure-vessel-bin.tar.gz')
         os.link(str(a), upload / a.name)
 
         a = Path('_build', 'production', 'pressure-vessel-bin+src.tar.gz')
 
+        # Map from path relative to upload/ to SHA256
+        digests = {}    # type: typing.Dict[str, str]
+
         # Unpack sources/*.{dsc,tar.*,txt,...} into sources/
-        with tarfile.open(str(a), 'r') as unarchiver:
+        # Use stream mode to decompress the archive in a single forward
+        # pass, instead of seeking around in the gzip stream
+        with tarfile.open(
+            str(a), 'r|*', bufsize=BLOCK_SIZE,
+        ) as unarchiver:
             for member in unarchiver:
                 parts = member.name.split('/')
 
@@ -270,9 +500,14 @@ class Uploader:
                         with open(
                             str(sources / parts[-1]), 'wb'
                         ) as writer:
-                            shutil.copyfileobj(extract, writer)
+                            # Hash the file while we have its contents
+                            # in memory, instead of reading it back later
+                            digests['sources/' + parts[-1]] = copy_and_hash(
+                                extract, writer,
+                            )
 
         os.link(str(sources / 'VERSION.txt'), str(upload / 'VERSION.txt'))
+        digests['VERSION.txt'] = digests['sources/VERSION.txt']
 
         to_hash: typing.List[str] = []
 
@@ -282,20 +517,18 @@ class Uploader:
             for f in filenames:
                 to_hash.append(str(Path(relpath, f)))
 
+        hash_cache = HashCache(Path('_build', '.hashcache.json'))
+
         with open(str(upload / 'SHA256SUMS'), 'w') as text_writer:
             for f in sorted(to_hash):
-                hasher = hashlib.sha256()
-
-                with open(str(upload / f), 'rb') as binary_reader:
-                    while True:
-                        blob = binary_reader.read(4096)
+                digest = digests.get(f)
 
-                        if not blob:
-                            break
+                if digest is None:
+                    digest = hash_cache.hash_file(upload / f)
 
-                        hasher.update(blob)
+                text_writer.write('{} *{}\n'.format(digest, f))
 
-                text_writer.write('{} *{}\n'.format(hasher.hexdigest(), f))
+        hash_cache.save()
 
         with open(str(upload / 'VERSION.txt')) as reader:
             version = reader.read().strip()
@@ -308,25 +541,23 @@ class Uploader:
         self.check_call([
             'mkdir', version,
         ])
-        self.check_call(
-            'if [ -d latest ]; then cp -al latest/sources {}; fi'.format(
-                shlex.quote(version)
-            ),
-            shell=True,
-        )
 
-        logger.info('Uploading artifacts using rsync...')
-
-        commands = [
-            # First pass: upload with --size-only to preserve hard-links
-            # among source tarballs, excluding *.txt because they might
-            # legitimately change without their size changing
+        # The passes into the versioned directory must run in order, but
+        # each element of this list is a sequence of commands that can run
+        # in parallel with the others, all sharing the ssh connection
+        command_sequences = [[
+            # First pass: upload with --size-only and --link-dest to
+            # hard-link source tarballs that are unchanged since the
+            # previous release instead of transferring them, excluding
+            # *.txt because they might legitimately change without their
+            # size changing
             [
                 'rsync',
-                '--rsh', ' '.join(map(shlex.quote, self.ssh[:-1])),
+                '--rsh', self.rsync_rsh,
                 '--chmod=a+rX,og-w',
                 '--delete',
                 '--exclude=*.txt',
+                '--link-dest=../../latest/sources/',
                 '--links',
                 '--partial',
                 '--perms',
@@ -342,7 +573,7 @@ class Uploader:
             # without --size-only
             [
                 'rsync',
-                '--rsh', ' '.join(map(shlex.quote, self.ssh[:-1])),
+                '--rsh', self.rsync_rsh,
                 '--chmod=a+rX,og-w',
                 '--delete',
                 '--exclude=*.debian.tar.*',
@@ -357,15 +588,15 @@ class Uploader:
                 '_build/upload/',
                 '{}:{}/{}/'.format(self.ssh_target, self.basedir, version),
             ]
-        ]
+        ]]
 
         if self.dbgsym_path:
             # Upload detached debug symbols and all packages that might
             # contain executables to a directory from which debuginfod will
             # read them
-            commands.append([
+            command_sequences.append([[
                 'rsync',
-                '--rsh', ' '.join(map(shlex.quote, self.ssh[:-1])),
+                '--rsh', self.rsync_rsh,
                 '--chmod=a+rX,og-w',
                 '--links',
                 '--partial',
@@ -377,23 +608,37 @@ class Uploader:
                 '{}:{}/'.format(
                     self.ssh_target, self.dbgsym_path,
                 ),
-            ])
+            ]])
 
-        for argv in commands:
-            if self.dry_run:
-                logger.info('Would run: %r', argv)
-            else:
-                logger.info('%r', argv)
-                subprocess.check_call(argv)
+        if self.call(['test', '-d', 'latest']) == 0:
+            logger.info('Uploading artifacts using rsync...')
+        else:
+            # There is no previous release for rsync's delta-transfer to
+            # compare with, so stream everything in a single tar pipe
+            # instead of paying for rsync's per-file protocol overhead
+            logger.info('Uploading artifacts using tar...')
+            command_sequences[0] = []
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(command_sequences),
+        ) as executor:
+            futures = [
+                executor.submit(self.run_local_commands, commands)
+                for commands in command_sequences
+            ]
+
+            if not command_sequences[0]:
+                futures.append(
+                    executor.submit(self.upload_with_tar, upload, version)
+                )
+
+            for future in futures:
+                future.result()
 
         if not self.dry_run:
             # Check that our rsync options didn't optimize away a change that
             # should have happened
-            with open(str(upload / 'SHA256SUMS')) as reader:
-                self.check_call([
-                    'env', '--chdir', '{}'.format(version),
-                    'sha256sum', '--strict', '--quiet', '-c',
-                ], stdin=reader)
+            self.verify_sha256sums(upload / 'SHA256SUMS', version)
 
             self.check_call([
                 'ln', '-fns', version, 'latest',
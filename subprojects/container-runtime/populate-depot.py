@@ -34,42 +34,60 @@ should not require a Python version newer than the 3.6.
 """
 
 import argparse
+import email.message
 import errno
+import fcntl
+import fnmatch
+import functools
 import gzip
 import hashlib
+import importlib.util
+import io
 import json
 import logging
+import mmap
 import os
+import random
 import re
 import shlex
 import shutil
+import socket
 import stat
 import subprocess
+import sys
 import tempfile
+import threading
+import time
+import urllib.error
 import urllib.parse
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import suppress
 from pathlib import Path
 from typing import (
     Any,
+    BinaryIO,
+    Callable,
     Dict,
+    IO,
+    Iterator,
     List,
+    NamedTuple,
     Optional,
     Sequence,
     Set,
     Tuple,
+    TypeVar,
+    Union,
 )
 
-from debian.deb822 import (
-    Sources,
-)
-
-
 HERE = Path(__file__).resolve().parent
 
 
 logger = logging.getLogger('populate-depot')
 
+T = TypeVar('T')
+
 
 DEFAULT_PRESSURE_VESSEL_URI = (
     'https://repo.steampowered.com/pressure-vessel/snapshots'
@@ -80,16 +98,591 @@ DEFAULT_IMAGES_URI = (
 )
 
 
+# Maximum number of files to download in parallel
+DOWNLOAD_JOBS = 4
+
+# Mirrors that take longer than this many seconds to respond to a HEAD
+# request are only used if all the others fail
+MIRROR_PROBE_TIMEOUT = 0.5
+
+# Size of the blocks in which we copy and hash files
+BLOCK_SIZE = 1024 * 1024
+
+# From <linux/fs.h>: share the source's storage on copy-on-write
+# filesystems such as btrfs and xfs
+FICLONE = 0x40049409
+
+
 class InvocationError(Exception):
     pass
 
 
+def copy_file(source: str, dest: str) -> None:
+    '''
+    Copy the contents and permissions of source to dest, preferably
+    with a reflink or an in-kernel copy rather than through userspace.
+    '''
+    with open(source, 'rb') as reader, open(dest, 'wb') as writer:
+        try:
+            fcntl.ioctl(writer.fileno(), FICLONE, reader.fileno())
+        except OSError:
+            copy_file_contents(reader, writer)
+
+    shutil.copymode(source, dest)
+
+
+def copy_file_contents(reader: BinaryIO, writer: BinaryIO) -> None:
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while os.copy_file_range(
+                reader.fileno(), writer.fileno(), 64 * BLOCK_SIZE,
+            ):
+                pass
+        except OSError as e:
+            if e.errno not in (
+                errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.EXDEV,
+            ):
+                raise
+
+            reader.seek(0)
+            writer.seek(0)
+            writer.truncate()
+        else:
+            return
+
+    shutil.copyfileobj(reader, writer, BLOCK_SIZE)
+
+
+def link_replacing(source: str, dest: str) -> None:
+    '''
+    Make dest a hard link to source, atomically replacing any existing
+    dest.
+    '''
+    try:
+        os.link(source, dest)
+    except FileExistsError:
+        if os.path.samefile(source, dest):
+            return
+
+        temp = dest + '.tmp'
+
+        with suppress(FileNotFoundError):
+            os.unlink(temp)
+
+        os.link(source, temp)
+        os.replace(temp, dest)
+
+
+def write_executable(path: str, text: str) -> None:
+    '''
+    Replace the contents of path with text, and make it executable.
+    '''
+    with open(path, 'w') as writer:
+        writer.write(text)
+        os.fchmod(writer.fileno(), 0o755)
+
+
+def rm_rf(path: str) -> None:
+    '''
+    Recursively delete path, if it exists.
+
+    This is much faster than shutil.rmtree() for large directory trees
+    like an unpacked runtime, which has a lot of per-file overhead.
+    '''
+    subprocess.run(['rm', '-fr', '--', path], check=True)
+
+
+def scandir_recursive(path: str) -> Iterator['os.DirEntry[str]']:
+    '''
+    Yield an os.DirEntry for everything below path, in the same order
+    as Path(path).rglob('*'): each directory's entries, followed by the
+    entries of each of its subdirectories in turn. Symbolic links to
+    directories are not followed.
+    '''
+    with os.scandir(path) as scanner:
+        entries = list(scanner)
+
+    yield from entries
+
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from scandir_recursive(entry.path)
+
+
+def rsync_rsh(ssh_options: Sequence[str]) -> str:
+    '''
+    Return an argument for rsync --rsh that runs ssh with ssh_options.
+    '''
+    return ' '.join(shlex.quote(arg) for arg in ['ssh', *ssh_options])
+
+
+def split_mirrors(uri: str) -> List[str]:
+    '''
+    Split a comma-separated list of mirror URIs.
+    '''
+    return [m for m in uri.split(',') if m] or [uri]
+
+
+def probe_mirror(uri: str) -> Optional[float]:
+    '''
+    Return how many seconds uri took to respond to a HEAD request,
+    or None if it did not respond within MIRROR_PROBE_TIMEOUT.
+    '''
+    request = urllib.request.Request(uri + '/', method='HEAD')
+    start = time.monotonic()
+
+    try:
+        with urllib.request.urlopen(request, timeout=MIRROR_PROBE_TIMEOUT):
+            pass
+    except urllib.error.HTTPError:
+        # Any response at all means the mirror is up: it might just
+        # not allow directory listings, or need credentials
+        pass
+    except OSError:
+        return None
+
+    return time.monotonic() - start
+
+
+def order_mirrors(mirrors: Sequence[str]) -> List[str]:
+    '''
+    Return mirrors in the order we should try them.
+
+    Mirrors that respond within twice the time of the fastest are
+    shuffled, so that parallel builds spread their load between them
+    instead of all using the same one, followed by the slower mirrors
+    and then the ones that did not respond at all.
+    '''
+    if len(mirrors) < 2:
+        return list(mirrors)
+
+    with ThreadPoolExecutor(len(mirrors)) as executor:
+        latencies = list(executor.map(probe_mirror, mirrors))
+
+    responded = sorted(
+        (latency, mirror)
+        for latency, mirror in zip(latencies, mirrors)
+        if latency is not None
+    )
+    unresponsive = [
+        mirror
+        for latency, mirror in zip(latencies, mirrors)
+        if latency is None
+    ]
+
+    if not responded:
+        return list(mirrors)
+
+    fastest = responded[0][0]
+    near = [m for latency, m in responded if latency <= 2 * fastest]
+    far = [m for latency, m in responded if latency > 2 * fastest]
+    random.shuffle(near)
+    return near + far + unresponsive
+
+
+def try_mirrors(
+    mirrors: Sequence[str],
+    attempt: Callable[[str], T],
+) -> T:
+    '''
+    Return attempt(mirror) for the first of mirrors that does not
+    fail with a network error: an HTTP error response, a failure to
+    connect, or a timeout. Other errors, such as being unable to write
+    to the cache, are raised immediately.
+    '''
+    for mirror in mirrors[:-1]:
+        try:
+            return attempt(mirror)
+        except (
+            urllib.error.URLError,
+            socket.timeout,
+            TimeoutError,
+            ConnectionError,
+        ) as e:
+            logger.warning('Unable to use mirror %r: %s', mirror, e)
+
+    return attempt(mirrors[-1])
+
+
+def hash_stream(reader: io.RawIOBase, hasher: Any) -> None:
+    # Read into the same buffer every time, instead of allocating a
+    # new bytes object per block. This is per-call rather than global
+    # because we hash files from several download threads at once.
+    buf = bytearray(BLOCK_SIZE)
+    view = memoryview(buf)
+
+    while True:
+        n = reader.readinto(buf)
+
+        if not n:
+            break
+
+        hasher.update(view[:n])
+
+
+def sha256_file(path: str) -> str:
+    with open(path, 'rb', buffering=0) as reader:
+        if sys.version_info >= (3, 11):
+            # Loops in C, without a Python-level iteration per block
+            return hashlib.file_digest(reader, 'sha256').hexdigest()
+
+        if os.fstat(reader.fileno()).st_size == 0:
+            # mmap() can't map an empty file
+            return hashlib.sha256().hexdigest()
+
+        # Hash the whole file in one call, letting the kernel page it in
+        with mmap.mmap(reader.fileno(), 0, prot=mmap.PROT_READ) as mapped:
+            return hashlib.sha256(mapped).hexdigest()
+
+
+def _sha256_sidecar_key(path: str) -> Dict[str, int]:
+    stat_info = os.stat(path)
+    return dict(
+        dev=stat_info.st_dev,
+        ino=stat_info.st_ino,
+        size=stat_info.st_size,
+        mtime_ns=stat_info.st_mtime_ns,
+    )
+
+
+def replace_with_json(path: str, data: Any) -> None:
+    '''
+    Atomically replace path with data, serialized as JSON.
+
+    The temporary file has a unique name, so that several threads can
+    write to the same path at the same time: the last one to finish
+    wins.
+    '''
+    with tempfile.NamedTemporaryFile(
+        'w',
+        dir=os.path.dirname(path) or '.',
+        prefix=os.path.basename(path) + '.',
+        suffix='.new',
+        delete=False,
+    ) as writer:
+        try:
+            json.dump(data, writer)
+        except BaseException:
+            os.unlink(writer.name)
+            raise
+
+    os.replace(writer.name, path)
+
+
+def write_sha256_sidecar(path: str, digest: str) -> None:
+    '''
+    Remember that path has the given SHA256, until it is modified.
+    '''
+    replace_with_json(
+        path + '.sha256',
+        dict(sha256=digest, **_sha256_sidecar_key(path)),
+    )
+
+
+def sha256_file_cached(path: str) -> str:
+    '''
+    Return the SHA256 of path, reusing the result recorded by
+    write_sha256_sidecar() if path has not been modified since then.
+    '''
+    try:
+        with open(path + '.sha256', 'r') as reader:
+            cached = json.load(reader)
+    except (OSError, ValueError):
+        pass
+    else:
+        digest = cached.pop('sha256', None)
+
+        if digest is not None and cached == _sha256_sidecar_key(path):
+            return digest
+
+    digest = sha256_file(path)
+    write_sha256_sidecar(path, digest)
+    return digest
+
+
+def download_http(
+    opener: urllib.request.OpenerDirector,
+    uri: str,
+    dest: str,
+    sha256: Optional[str] = None,
+    tee: Optional[IO[bytes]] = None,
+) -> None:
+    '''
+    Download uri into dest via a temporary file dest.new.
+
+    If the expected sha256 is known, a dest.new left behind by an
+    interrupted download is resumed with a HTTP Range request, and
+    the result is checked against sha256. If that check fails after
+    resuming, the download is restarted from the beginning.
+
+    If tee is not None, every block is also written to it as it
+    arrives. In that case the download always starts from the
+    beginning, because whatever is reading from tee needs all of it.
+    '''
+    partial = dest + '.new'
+    offset = 0
+
+    if sha256 is not None and tee is None:
+        with suppress(FileNotFoundError):
+            offset = os.stat(partial).st_size
+
+    request = urllib.request.Request(uri)
+
+    if offset > 0:
+        request.add_header('Range', 'bytes={}-'.format(offset))
+
+    try:
+        response = opener.open(request)
+    except urllib.error.HTTPError as e:
+        if offset > 0 and e.code == 416:
+            # Range Not Satisfiable: dest.new is no use to us
+            logger.info('Unable to resume download of %r', uri)
+            os.unlink(partial)
+            download_http(opener, uri, dest, sha256)
+            return
+
+        raise
+
+    with response:
+        if (
+            offset > 0
+            and response.status == 206
+            and response.headers.get('Content-Range', '').startswith(
+                'bytes {}-'.format(offset)
+            )
+        ):
+            logger.info('Resuming download of %r at byte %d', uri, offset)
+            mode = 'ab'
+        else:
+            offset = 0
+            mode = 'wb'
+
+        hasher = hashlib.sha256()
+
+        if offset > 0:
+            with open(partial, 'rb', buffering=0) as reader:
+                hash_stream(reader, hasher)
+
+        with open(partial, mode) as writer:
+            # Hash the data while we have it in memory, instead of
+            # reading it back from disk afterwards
+            while True:
+                blob = response.read(BLOCK_SIZE)
+
+                if not blob:
+                    break
+
+                hasher.update(blob)
+                writer.write(blob)
+
+                if tee is not None:
+                    tee.write(blob)
+
+    digest = hasher.hexdigest()
+
+    if sha256 is not None:
+        if digest != sha256:
+            os.unlink(partial)
+
+            if offset > 0:
+                logger.info('Resumed download of %r was corrupt', uri)
+                download_http(opener, uri, dest, sha256)
+                return
+
+            raise RuntimeError(
+                'Expected {} to have SHA256 {}, but got {}'.format(
+                    uri, sha256, digest,
+                )
+            )
+
+    os.rename(partial, dest)
+    write_sha256_sidecar(dest, digest)
+
+
+def parse_sha256sums(sha256sums: bytes) -> Dict[str, str]:
+    '''
+    Parse sha256sum(1) output in text or binary (*) mode, and return
+    a dict mapping filenames to their SHA256.
+    '''
+    sha256 = {}     # type: Dict[str, str]
+
+    for line in sha256sums.splitlines():
+        sha256_bytes, name_bytes = line.split(maxsplit=1)
+        name = name_bytes.decode('utf-8')
+
+        if name.startswith('*'):
+            name = name[1:]
+
+        sha256[name] = sha256_bytes.decode('ascii')
+
+    return sha256
+
+
+def read_version_txt(
+    opener: urllib.request.OpenerDirector,
+    uri: str,
+    cache: str,
+) -> str:
+    '''
+    Return the contents of the VERSION.txt at uri, stripped.
+
+    The result is remembered in the JSON file cache together with the
+    server's ETag and Last-Modified headers, so that next time we can
+    make a conditional request and reuse it if it has not changed.
+    '''
+    cached = {}     # type: Dict[str, str]
+
+    try:
+        with open(cache) as reader:
+            cached = json.load(reader)
+    except (OSError, ValueError):
+        pass
+
+    if not isinstance(cached, dict) or cached.get('uri') != uri:
+        cached = {}
+
+    request = urllib.request.Request(uri)
+
+    if 'version' in cached:
+        if cached.get('etag'):
+            request.add_header('If-None-Match', cached['etag'])
+
+        if cached.get('last_modified'):
+            request.add_header('If-Modified-Since', cached['last_modified'])
+
+    try:
+        with opener.open(request) as response:
+            version = response.read().decode('utf-8').strip()
+            etag = response.headers.get('ETag', '')
+            last_modified = response.headers.get('Last-Modified', '')
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and 'version' in cached:
+            logger.info('%r has not changed', uri)
+            return cached['version']
+
+        raise
+
+    if etag or last_modified:
+        replace_with_json(
+            cache,
+            dict(
+                uri=uri,
+                etag=etag,
+                last_modified=last_modified,
+                version=version,
+            ),
+        )
+
+    return version
+
+
+class RequestsResponse:
+    '''
+    Adapter to make a streaming requests.Response look enough like the
+    result of urllib.request.urlopen() for our purposes.
+    '''
+
+    def __init__(self, response: Any) -> None:
+        self.response = response
+        self.headers = response.headers
+        self.status = response.status_code
+
+    def __enter__(self) -> 'RequestsResponse':
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        # If the body was read to the end, this returns the connection
+        # to the pool for reuse
+        self.response.close()
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            return self.response.raw.read()
+        else:
+            return self.response.raw.read(size)
+
+
+@functools.lru_cache(maxsize=None)
+def have_requests() -> bool:
+    '''
+    Return True if the requests module is available.
+
+    It is only imported when we are going to download something,
+    because importing it takes longer than everything else that
+    populate-depot --help does.
+    '''
+    return importlib.util.find_spec('requests') is not None
+
+
+class RequestsOpener(urllib.request.OpenerDirector):
+    '''
+    Drop-in replacement for the OpenerDirector returned by
+    urllib.request.build_opener(), using a requests.Session so that
+    connections are kept alive and reused between requests to the
+    same host, avoiding a new TCP and TLS handshake per file.
+    '''
+
+    def __init__(self, credentials: Dict[str, Tuple[str, str]]) -> None:
+        import requests
+
+        super().__init__()
+        self.credentials = credentials
+        self.session = requests.Session()
+        # Behave like urllib, which does not ask for compression
+        self.session.headers['Accept-Encoding'] = 'identity'
+
+    def open(        # type: ignore
+        self,
+        fullurl: Union[str, urllib.request.Request],
+        data: Any = None,
+        timeout: Any = None,
+    ) -> RequestsResponse:
+        if isinstance(fullurl, str):
+            request = urllib.request.Request(fullurl)
+        else:
+            request = fullurl
+
+        url = request.full_url
+        parsed = urllib.parse.urlparse(url)
+        auth = self.credentials.get(
+            parsed.netloc,
+            self.credentials.get(parsed.hostname or ''),
+        )
+        import requests
+
+        try:
+            response = self.session.get(
+                url,
+                auth=auth,
+                headers=dict(request.header_items()),
+                stream=True,
+                timeout=timeout,
+            )
+        except requests.RequestException as e:
+            # Raise the same exception as urllib would
+            raise urllib.error.URLError(e)
+
+        if not 200 <= response.status_code < 300:
+            headers = email.message.Message()
+
+            for k, v in response.headers.items():
+                headers[k] = v
+
+            response.close()
+            raise urllib.error.HTTPError(
+                url, response.status_code, response.reason, headers, None,
+            )
+
+        return RequestsResponse(response)
+
+
 class PressureVesselRelease:
     def __init__(
         self,
         *,
         cache: str = '.cache',
         ssh_host: str = '',
+        ssh_options: Sequence[str] = (),
         ssh_path: str = '',
         uri: str = DEFAULT_PRESSURE_VESSEL_URI,
         version: str = ''
@@ -97,16 +690,18 @@ class PressureVesselRelease:
         self.cache = cache
         self.pinned_version = None      # type: Optional[str]
         self.ssh_host = ssh_host
+        self.ssh_options = ssh_options
         self.ssh_path = ssh_path
-        self.uri = uri
+        self.mirrors = split_mirrors(uri)
         self.version = version
 
     def get_uri(
         self,
         filename: str,
         version: Optional[str] = None,
+        mirror: Optional[str] = None,
     ) -> str:
-        uri = self.uri
+        uri = mirror or self.mirrors[0]
         v = version or self.pinned_version or self.version or 'latest'
         return f'{uri}/{v}/{filename}'
 
@@ -133,25 +728,24 @@ class PressureVesselRelease:
         dest = os.path.join(self.cache, filename)
 
         if self.ssh_host and self.ssh_path:
-            path = self.get_ssh_path(filename)
+            path = self.get_ssh_path(filename, version)
             logger.info('Downloading %r...', path)
             subprocess.run([
                 'rsync',
                 '--archive',
                 '--partial',
                 '--progress',
+                '--rsh=' + rsync_rsh(self.ssh_options),
                 self.ssh_host + ':' + path,
                 dest,
             ], check=True)
         else:
-            uri = self.get_uri(filename)
-            logger.info('Downloading %r...', uri)
-
-            with opener.open(uri) as response:
-                with open(dest + '.new', 'wb') as writer:
-                    shutil.copyfileobj(response, writer)
+            def download_from(mirror: str) -> None:
+                uri = self.get_uri(filename, version, mirror)
+                logger.info('Downloading %r...', uri)
+                download_http(opener, uri, dest)
 
-                os.rename(dest + '.new', dest)
+            try_mirrors(self.mirrors, download_from)
 
         return dest
 
@@ -165,21 +759,70 @@ class PressureVesselRelease:
             if self.ssh_host and self.ssh_path:
                 path = self.get_ssh_path(filename='VERSION.txt')
                 logger.info('Determining version number from %r...', path)
-                pinned = subprocess.run([
-                    'ssh', self.ssh_host,
+                output = subprocess.run([
+                    'ssh', *self.ssh_options, self.ssh_host,
                     'cat {}'.format(shlex.quote(path)),
-                ], stdout=subprocess.PIPE).stdout.decode('utf-8').strip()
+                ], stdout=subprocess.PIPE, check=True).stdout
+                pinned = output.decode('utf-8').strip()
             else:
-                uri = self.get_uri(filename='VERSION.txt')
-                logger.info('Determining version number from %r...', uri)
-                with opener.open(uri) as response:
-                    pinned = response.read().decode('utf-8').strip()
+                def read_from(mirror: str) -> str:
+                    uri = self.get_uri(filename='VERSION.txt', mirror=mirror)
+                    logger.info('Determining version number from %r...', uri)
+                    version = read_version_txt(
+                        opener,
+                        uri,
+                        os.path.join(
+                            self.cache, 'pressure-vessel-VERSION.json',
+                        ),
+                    )
+                    # Download everything else from the same mirror,
+                    # unless that fails
+                    self.mirrors.remove(mirror)
+                    self.mirrors.insert(0, mirror)
+                    return version
+
+                self.mirrors = order_mirrors(self.mirrors)
+                pinned = try_mirrors(list(self.mirrors), read_from)
 
             self.pinned_version = pinned
 
         return pinned
 
 
+RUNTIME_PREFIX = 'com.valvesoftware.SteamRuntime'
+
+
+class RuntimeFilenames(NamedTuple):
+    tarball: str
+    dockerfile: str
+    sdk_tarball: str
+    debug_tarball: str
+    sysroot_tarball: str
+    build_id_file: str
+    sdk_build_id_file: str
+    sources: str
+
+
+@functools.lru_cache(maxsize=64)
+def runtime_filenames(architecture: str, suite: str) -> RuntimeFilenames:
+    '''
+    Return the names of the files that make up a runtime build.
+    '''
+    platform = RUNTIME_PREFIX + '.Platform'
+    sdk = RUNTIME_PREFIX + '.Sdk'
+
+    return RuntimeFilenames(
+        tarball=f'{platform}-{architecture}-{suite}-runtime.tar.gz',
+        dockerfile=f'{sdk}-{architecture}-{suite}-sysroot.Dockerfile',
+        sdk_tarball=f'{sdk}-{architecture}-{suite}-runtime.tar.gz',
+        debug_tarball=f'{sdk}-{architecture}-{suite}-debug.tar.gz',
+        sysroot_tarball=f'{sdk}-{architecture}-{suite}-sysroot.tar.gz',
+        build_id_file=f'{platform}-{architecture}-{suite}-buildid.txt',
+        sdk_build_id_file=f'{sdk}-{architecture}-{suite}-buildid.txt',
+        sources=f'{sdk}-{architecture}-{suite}-sources.deb822.gz',
+    )
+
+
 class Runtime:
     def __init__(
         self,
@@ -193,67 +836,51 @@ class Runtime:
         official: bool = False,
         path: Optional[str] = None,
         ssh_host: str = '',
+        ssh_options: Sequence[str] = (),
         ssh_path: str = '',
         version: str = '',
     ) -> None:
         self.architecture = architecture
         self.cache = cache
         self.images_uri = images_uri
+        self.mirrors = [
+            mirror.replace('SUITE', suite)
+            for mirror in split_mirrors(images_uri)
+        ]
         self.name = name
         self.official = official
         self.path = path
         self.suite = suite
         self.ssh_host = ssh_host
+        self.ssh_options = ssh_options
         self.ssh_path = ssh_path
+        self.ssh_path_base = ssh_path.replace('SUITE', suite)
         self.version = version
         self.pinned_version = None      # type: Optional[str]
+        # The version used in paths when not specified, updated by
+        # pin_version()
+        self.path_version = version or 'latest'
         self.sha256 = {}                # type: Dict[str, str]
+        # The same runtime can be used for pressure-vessel, the
+        # LD_LIBRARY_PATH runtime and the container runtime, which
+        # are downloaded in parallel
+        self.pin_lock = threading.Lock()
 
         os.makedirs(self.cache, exist_ok=True)
 
-        self.prefix = 'com.valvesoftware.SteamRuntime'
+        self.prefix = RUNTIME_PREFIX
         self.platform = self.prefix + '.Platform'
         self.sdk = self.prefix + '.Sdk'
-        self.tarball = '{}-{}-{}-runtime.tar.gz'.format(
-            self.platform,
-            self.architecture,
-            self.suite,
-        )
-        self.dockerfile = '{}-{}-{}-sysroot.Dockerfile'.format(
-            self.sdk,
-            self.architecture,
-            self.suite,
-        )
-        self.sdk_tarball = '{}-{}-{}-runtime.tar.gz'.format(
-            self.sdk,
-            self.architecture,
-            self.suite,
-        )
-        self.debug_tarball = '{}-{}-{}-debug.tar.gz'.format(
-            self.sdk,
-            self.architecture,
-            self.suite,
-        )
-        self.sysroot_tarball = '{}-{}-{}-sysroot.tar.gz'.format(
-            self.sdk,
-            self.architecture,
-            self.suite,
-        )
-        self.build_id_file = '{}-{}-{}-buildid.txt'.format(
-            self.platform,
-            self.architecture,
-            self.suite,
-        )
-        self.sdk_build_id_file = '{}-{}-{}-buildid.txt'.format(
-            self.sdk,
-            self.architecture,
-            self.suite,
-        )
-        self.sources = '{}-{}-{}-sources.deb822.gz'.format(
-            self.sdk,
-            self.architecture,
-            self.suite,
-        )
+
+        names = runtime_filenames(self.architecture, self.suite)
+        self.tarball = names.tarball
+        self.dockerfile = names.dockerfile
+        self.sdk_tarball = names.sdk_tarball
+        self.debug_tarball = names.debug_tarball
+        self.sysroot_tarball = names.sysroot_tarball
+        self.build_id_file = names.build_id_file
+        self.sdk_build_id_file = names.sdk_build_id_file
+        self.sources = names.sources
 
     def get_archives(
         self,
@@ -289,6 +916,7 @@ class Runtime:
         default_version: str = '',
         images_uri: str = DEFAULT_IMAGES_URI,
         ssh_host: str = '',
+        ssh_options: Sequence[str] = (),
         ssh_path: str = '',
     ):
         return cls(
@@ -301,6 +929,7 @@ class Runtime:
             official=details.get('official', False),
             path=details.get('path', None),
             ssh_host=ssh_host,
+            ssh_options=ssh_options,
             ssh_path=ssh_path,
             suite=details.get('suite', default_suite or name),
             version=details.get('version', default_version),
@@ -310,10 +939,10 @@ class Runtime:
         self,
         filename: str,
         version: Optional[str] = None,
+        mirror: Optional[str] = None,
     ) -> str:
-        suite = self.suite
-        uri = self.images_uri.replace('SUITE', suite)
-        v = version or self.pinned_version or self.version or 'latest'
+        uri = mirror or self.mirrors[0]
+        v = version or self.path_version
         return f'{uri}/{v}/{filename}'
 
     def get_ssh_path(
@@ -321,114 +950,198 @@ class Runtime:
         filename: str,
         version: Optional[str] = None,
     ) -> str:
-        ssh_host = self.ssh_host
-        suite = self.suite
-        ssh_path = self.ssh_path.replace('SUITE', suite)
-        v = version or self.pinned_version or self.version or 'latest'
-
-        if not ssh_host or not ssh_path:
+        if not self.ssh_host or not self.ssh_path:
             raise RuntimeError('ssh host/path not configured')
 
-        return f'{ssh_path}/{v}/{filename}'
+        v = version or self.path_version
+        return f'{self.ssh_path_base}/{v}/{filename}'
 
     def fetch(
         self,
         filename: str,
         opener: urllib.request.OpenerDirector,
         version: Optional[str] = None,
+        tee: Optional[IO[bytes]] = None,
     ) -> str:
-        dest = os.path.join(self.cache, filename)
+        if self.ssh_host and self.ssh_path:
+            assert tee is None
+            return self.fetch_many([filename])[filename]
 
-        if filename in self.sha256:
-            try:
-                with open(dest, 'rb') as reader:
-                    hasher = hashlib.sha256()
+        dest = os.path.join(self.cache, filename)
 
-                    while True:
-                        blob = reader.read(4096)
+        if not self.is_cached(filename):
+            def download_from(mirror: str) -> None:
+                uri = self.get_uri(filename, mirror=mirror)
+                logger.info('Downloading %r...', uri)
+                download_http(
+                    opener, uri, dest, self.sha256.get(filename), tee=tee,
+                )
 
-                        if not blob:
-                            break
+            if tee is None:
+                try_mirrors(self.mirrors, download_from)
+            else:
+                # Whatever is reading from tee has already seen the
+                # data we downloaded, so we cannot start again elsewhere
+                download_from(self.mirrors[0])
 
-                        hasher.update(blob)
+        return dest
 
-                    digest = hasher.hexdigest()
-            except OSError:
-                pass
-            else:
-                if digest == self.sha256[filename]:
-                    logger.info('Using cached %r', dest)
-                    return dest
+    def fetch_many(
+        self,
+        filenames: Sequence[str],
+    ) -> Dict[str, str]:
+        '''
+        Download filenames with a single rsync command, and return a
+        dict mapping each filename to the path where it was downloaded.
+        '''
+        wanted = [f for f in filenames if not self.is_cached(f)]
 
-        if self.ssh_host and self.ssh_path:
-            path = self.get_ssh_path(filename)
-            logger.info('Downloading %r...', path)
+        if wanted:
+            path = self.get_ssh_path('')
+            file_list = b'\0'.join(f.encode('utf-8') for f in wanted)
+            logger.info('Downloading %r from %r...', wanted, path)
             subprocess.run([
                 'rsync',
                 '--archive',
                 '--partial',
                 '--progress',
+                '--from0',
+                '--files-from=-',
+                '--rsh=' + rsync_rsh(self.ssh_options),
                 self.ssh_host + ':' + path,
-                dest,
-            ], check=True)
-        else:
-            uri = self.get_uri(filename)
-            logger.info('Downloading %r...', uri)
+                self.cache + '/',
+            ], input=file_list, check=True)
 
-            with opener.open(uri) as response:
-                with open(dest + '.new', 'wb') as writer:
-                    shutil.copyfileobj(response, writer)
+        return {f: os.path.join(self.cache, f) for f in filenames}
 
-                os.rename(dest + '.new', dest)
+    def is_cached(self, filename: str) -> bool:
+        dest = os.path.join(self.cache, filename)
 
-        return dest
+        if filename not in self.sha256:
+            return False
+
+        try:
+            digest = sha256_file_cached(dest)
+        except OSError:
+            return False
+
+        if digest != self.sha256[filename]:
+            return False
+
+        logger.info('Using cached %r', dest)
+        return True
+
+    def get_sha256sums_cache(self, version: str) -> str:
+        return os.path.join(
+            self.cache,
+            '{}-{}-sha256.json'.format(self.suite, version),
+        )
+
+    def load_sha256sums(
+        self,
+        version: str,
+        source: str,
+    ) -> Optional[Dict[str, str]]:
+        '''
+        Return the checksums parsed from SHA256SUMS by a previous run
+        for the same version, or None if there are none or they came
+        from a different location.
+        '''
+        try:
+            with open(self.get_sha256sums_cache(version)) as reader:
+                cached = json.load(reader)
+        except (OSError, ValueError):
+            return None
+
+        if not isinstance(cached, dict) or cached.get('source') != source:
+            return None
+
+        sha256 = cached.get('sha256')
+
+        if not isinstance(sha256, dict):
+            return None
+
+        logger.info('Using cached checksums for %s', source)
+        return sha256
+
+    def save_sha256sums(
+        self,
+        version: str,
+        source: str,
+        sha256: Dict[str, str],
+    ) -> None:
+        replace_with_json(
+            self.get_sha256sums_cache(version),
+            dict(source=source, sha256=sha256),
+        )
 
     def pin_version(
         self,
         opener: urllib.request.OpenerDirector,
+    ) -> str:
+        with self.pin_lock:
+            return self.pin_version_locked(opener)
+
+    def pin_version_locked(
+        self,
+        opener: urllib.request.OpenerDirector,
     ) -> str:
         pinned = self.pinned_version
-        sha256 = {}     # type: Dict[str, str]
 
         if pinned is None:
+            sha256sums = None       # type: Optional[bytes]
+
             if self.ssh_host and self.ssh_path:
                 path = self.get_ssh_path(filename='VERSION.txt')
+                source = self.get_ssh_path(filename='SHA256SUMS')
                 logger.info('Determining version number from %r...', path)
-                pinned = subprocess.run([
-                    'ssh', self.ssh_host,
-                    'cat {}'.format(shlex.quote(path)),
-                ], stdout=subprocess.PIPE).stdout.decode('utf-8').strip()
-
-                path = self.get_ssh_path(filename='SHA256SUMS')
-
-                sha256sums = subprocess.run([
-                    'ssh', self.ssh_host,
-                    'cat {}'.format(shlex.quote(path)),
-                ], stdout=subprocess.PIPE).stdout
-                assert sha256sums is not None
-
+                # Fetch both files in one round-trip, separated by \0
+                # which cannot appear in either of them
+                output = subprocess.run([
+                    'ssh', *self.ssh_options, self.ssh_host,
+                    'cat {} && printf "\\0" && cat {}'.format(
+                        shlex.quote(path),
+                        shlex.quote(source),
+                    ),
+                ], stdout=subprocess.PIPE, check=True).stdout
+                version_bytes, sha256sums = output.split(b'\0', 1)
+                pinned = version_bytes.decode('utf-8').strip()
+                source = self.ssh_host + ':' + source
             else:
-                uri = self.get_uri(filename='VERSION.txt')
-                logger.info('Determining version number from %r...', uri)
-                with opener.open(uri) as response:
-                    pinned = response.read().decode('utf-8').strip()
+                def read_from(mirror: str) -> str:
+                    uri = self.get_uri(filename='VERSION.txt', mirror=mirror)
+                    logger.info('Determining version number from %r...', uri)
+                    version = read_version_txt(
+                        opener,
+                        uri,
+                        os.path.join(
+                            self.cache, '{}-VERSION.json'.format(self.suite),
+                        ),
+                    )
+                    # Download everything else from the same mirror,
+                    # unless that fails
+                    self.mirrors.remove(mirror)
+                    self.mirrors.insert(0, mirror)
+                    return version
 
-                uri = self.get_uri(filename='SHA256SUMS')
+                self.mirrors = order_mirrors(self.mirrors)
+                pinned = try_mirrors(list(self.mirrors), read_from)
+                source = self.get_uri(filename='SHA256SUMS')
 
-                with opener.open(uri) as response:
-                    sha256sums = response.read()
+            sha256 = self.load_sha256sums(pinned, source)
 
-            for line in sha256sums.splitlines():
-                sha256_bytes, name_bytes = line.split(maxsplit=1)
-                name = name_bytes.decode('utf-8')
+            if sha256 is None:
+                if sha256sums is None:
+                    with opener.open(source) as response:
+                        sha256sums = response.read()
 
-                if name.startswith('*'):
-                    name = name[1:]
+                sha256 = parse_sha256sums(sha256sums)
 
-                sha256[name] = sha256_bytes.decode('ascii')
+                self.save_sha256sums(pinned, source, sha256)
 
             self.sha256 = sha256
             self.pinned_version = pinned
+            self.path_version = pinned or self.version or 'latest'
 
         return pinned
 
@@ -567,18 +1280,20 @@ class Main:
         versioned_directories: bool = False,
         **kwargs: Dict[str, Any],
     ) -> None:
-        openers: List[urllib.request.BaseHandler] = []
+        # Map from hostname to (username, password)
+        self.credentials: Dict[str, Tuple[str, str]] = {}
+        self.thread_local = threading.local()
 
         if not credential_hosts:
             credential_hosts = []
-            host = urllib.parse.urlparse(images_uri).hostname
 
-            if host is not None:
-                credential_hosts.append(host)
+            for mirror in split_mirrors(images_uri):
+                host = urllib.parse.urlparse(mirror).hostname
 
-        if credential_envs:
-            password_manager = urllib.request.HTTPPasswordMgrWithDefaultRealm()
+                if host is not None:
+                    credential_hosts.append(host)
 
+        if credential_envs:
             for cred in credential_envs:
                 if ':' in cred:
                     username_env, password_env = cred.split(':', 1)
@@ -593,18 +1308,7 @@ class Main:
                     username, password = os.environ[cred].split(':', 1)
 
                 for host in credential_hosts:
-                    password_manager.add_password(
-                        None,       # type: ignore
-                        host,
-                        username,
-                        password,
-                    )
-
-            openers.append(
-                urllib.request.HTTPBasicAuthHandler(password_manager)
-            )
-
-        self.opener = urllib.request.build_opener(*openers)
+                    self.credentials[host] = (username, password)
 
         self.cache = cache
         self.default_architecture = architecture
@@ -678,6 +1382,11 @@ class Main:
             name = runtime
             details = {}
 
+        self.ssh_control_dir = ''
+        # Filled in by open_ssh_connections(). Every Runtime shares this
+        # list, so it must be modified in-place rather than replaced.
+        self.ssh_options: List[str] = []
+
         self.runtime = self.new_runtime(name, details)
 
         self.versions = []      # type: List[ComponentVersion]
@@ -727,6 +1436,67 @@ class Main:
                 default_suite='scout',
             )
 
+    def get_opener(self) -> urllib.request.OpenerDirector:
+        '''
+        Return an opener for use in the current thread.
+
+        OpenerDirector is not documented to be thread-safe, so each
+        thread that downloads files gets its own.
+        '''
+        opener = getattr(
+            self.thread_local, 'opener', None,
+        )   # type: Optional[urllib.request.OpenerDirector]
+
+        if opener is None:
+            if have_requests():
+                opener = RequestsOpener(self.credentials)
+            else:
+                handlers: List[urllib.request.BaseHandler] = []
+
+                if self.credentials:
+                    password_manager = (
+                        urllib.request.HTTPPasswordMgrWithDefaultRealm()
+                    )
+
+                    for host, (username, password) in (
+                        self.credentials.items()
+                    ):
+                        password_manager.add_password(
+                            None,       # type: ignore
+                            host,
+                            username,
+                            password,
+                        )
+
+                    handlers.append(
+                        urllib.request.HTTPBasicAuthHandler(password_manager)
+                    )
+
+                opener = urllib.request.build_opener(*handlers)
+
+            self.thread_local.opener = opener
+
+        return opener
+
+    def fetch_many(
+        self,
+        runtime: Runtime,
+        filenames: Sequence[str],
+    ) -> Dict[str, str]:
+        '''
+        Download filenames from runtime in parallel, and return a dict
+        mapping each filename to the path where it was downloaded.
+        '''
+        if runtime.ssh_host and runtime.ssh_path:
+            # rsync can transfer them all over one connection
+            return runtime.fetch_many(filenames)
+
+        def fetch(filename: str) -> str:
+            return runtime.fetch(filename, self.get_opener())
+
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_JOBS) as executor:
+            return dict(zip(filenames, executor.map(fetch, filenames)))
+
     def new_runtime(
         self,
         name: str,
@@ -742,6 +1512,7 @@ class Main:
             default_version=self.default_version,
             images_uri=self.images_uri,
             ssh_host=self.ssh_host,
+            ssh_options=self.ssh_options,
             ssh_path=self.ssh_path,
         )
 
@@ -749,30 +1520,75 @@ class Main:
         self,
         source_root: str,
     ):
-        for (dirpath, dirnames, filenames) in os.walk(source_root):
+        os.makedirs(self.depot, exist_ok=True)
+        pending = [source_root]
+
+        while pending:
+            dirpath = pending.pop()
             relative_path = os.path.relpath(dirpath, source_root)
 
-            for member in dirnames:
-                os.makedirs(
-                    os.path.join(self.depot, relative_path, member),
-                    exist_ok=True,
-                )
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    merged = os.path.join(
+                        self.depot, relative_path, entry.name,
+                    )
 
-            for member in filenames:
-                source = os.path.join(dirpath, member)
-                merged = os.path.join(self.depot, relative_path, member)
+                    if entry.is_dir():
+                        os.makedirs(merged, exist_ok=True)
 
-                with suppress(FileNotFoundError):
-                    os.unlink(merged)
+                        if not entry.is_symlink():
+                            pending.append(entry.path)
+
+                        continue
 
-                os.makedirs(os.path.dirname(merged), exist_ok=True)
-                shutil.copy(source, merged)
+                    # Not a hard link: files in the depot are sometimes
+                    # rewritten in-place, which must not alter the
+                    # source directory. copy_file() will share storage
+                    # via a reflink where the filesystem allows it.
+                    copy_file(entry.path, merged + '.new')
+                    os.replace(merged + '.new', merged)
 
     def run(self) -> None:
-        if self.layered:
-            self.do_layered_runtime()
-        else:
-            self.do_container_runtime()
+        try:
+            self.open_ssh_connections()
+
+            if self.layered:
+                self.do_layered_runtime()
+            else:
+                self.do_container_runtime()
+        finally:
+            self.close_ssh_connections()
+
+    def open_ssh_connections(self) -> None:
+        if not (self.ssh_host or self.pressure_vessel_ssh_host):
+            return
+
+        # Share one connection between all ssh and rsync commands
+        # for each host, instead of authenticating every time
+        self.ssh_control_dir = tempfile.mkdtemp(
+            prefix='populate-depot-ssh.',
+        )
+        self.ssh_options[:] = [
+            '-o', 'ControlMaster=auto',
+            '-o', 'ControlPersist=300',
+            '-o', 'ControlPath={}/%C'.format(self.ssh_control_dir),
+        ]
+
+    def close_ssh_connections(self) -> None:
+        if not self.ssh_control_dir:
+            return
+
+        for host in {self.ssh_host, self.pressure_vessel_ssh_host}:
+            if host:
+                subprocess.run(
+                    ['ssh', *self.ssh_options, '-O', 'exit', host],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+
+        shutil.rmtree(self.ssh_control_dir, ignore_errors=True)
+        self.ssh_control_dir = ''
+        self.ssh_options[:] = []
 
     def do_layered_runtime(self) -> None:
         if self.runtime.name != 'scout':
@@ -865,9 +1681,6 @@ class Main:
         paths: list[Path] = [
             # Nvidia cg toolkit manuals, tutorials and documentation
             doc / 'nvidia-cg-toolkit' / 'html',
-            *doc.glob('nvidia-cg-toolkit/*.pdf.gz'),
-            # Sample code
-            *doc.glob('**/examples'),
             # Debian bug reporting scripts
             usr_share / 'bug',
             # Debian documentation metadata
@@ -876,22 +1689,56 @@ class Main:
             usr_share / 'lintian',
             # Programs and utilities manuals
             usr_share / 'man',
-            # Remove the localized messages that are likely never going to be
-            # seen. Keep only "en", because that's the default language we are
-            # using.
-            *[x for x in usr_share.glob('locale/*') if x.name != 'en'],
         ]
 
-        for path in paths:
-            if path.is_dir():
+        # Walk doc once, rather than once per pattern. Don't descend
+        # into directories that are going to be deleted anyway, so that
+        # the paths to delete are disjoint.
+        for dirpath, dirnames, filenames in os.walk(doc):
+            # Nvidia cg toolkit manuals, tutorials and documentation
+            if dirpath == str(doc / 'nvidia-cg-toolkit'):
+                with suppress(ValueError):
+                    dirnames.remove('html')
+
+                paths.extend(
+                    Path(dirpath, name)
+                    for name in fnmatch.filter(filenames, '*.pdf.gz')
+                )
+
+            # Sample code
+            if 'examples' in dirnames:
+                dirnames.remove('examples')
+                paths.append(Path(dirpath, 'examples'))
+
+            # Like glob(), ignore dangling symlinks
+            if 'examples' in filenames and os.path.exists(
+                os.path.join(dirpath, 'examples'),
+            ):
+                paths.append(Path(dirpath, 'examples'))
+
+        # Remove the localized messages that are likely never going to be
+        # seen. Keep only "en", because that's the default language we are
+        # using.
+        with suppress(FileNotFoundError):
+            with os.scandir(usr_share / 'locale') as entries:
+                paths.extend(
+                    Path(entry.path) for entry in entries
+                    if entry.name != 'en'
+                )
+
+        def remove(path: Path) -> None:
+            if path.is_dir() and not path.is_symlink():
                 shutil.rmtree(path)
             else:
                 with suppress(FileNotFoundError):
                     path.unlink()
 
-    def do_container_runtime(self) -> None:
-        pv_version = ComponentVersion('pressure-vessel')
+        # The paths are disjoint, so they can be deleted in parallel
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for _ in executor.map(remove, paths):
+                pass
 
+    def do_container_runtime(self) -> None:
         self.merge_dir_into_depot(os.path.join(self.source_dir, 'common'))
 
         root = os.path.join(self.source_dir, 'runtimes', self.runtime.name)
@@ -899,6 +1746,26 @@ class Main:
         if os.path.exists(root):
             self.merge_dir_into_depot(root)
 
+        # These write to different parts of the depot and download
+        # different files, so they can happen at the same time
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [
+                executor.submit(self.populate_pressure_vessel),
+                executor.submit(self.populate_runtime),
+            ]
+
+            if self.unpack_ld_library_path:
+                futures.append(
+                    executor.submit(self.populate_ld_library_path)
+                )
+
+            for future in futures:
+                future.result()
+
+        self.write_component_versions()
+
+    def populate_pressure_vessel(self) -> None:
+        pv_version = ComponentVersion('pressure-vessel')
         pressure_vessel_runtime = self.pressure_vessel_runtime
 
         if self.pressure_vessel_version:
@@ -951,7 +1818,10 @@ class Main:
 
         self.versions.append(pv_version)
 
-        if self.unpack_ld_library_path and pressure_vessel_runtime is None:
+    def populate_ld_library_path(self) -> None:
+        pressure_vessel_runtime = self.pressure_vessel_runtime
+
+        if pressure_vessel_runtime is None:
             if self.runtime.name == 'scout':
                 scout = self.runtime
             else:
@@ -964,14 +1834,14 @@ class Main:
                 'Downloading LD_LIBRARY_PATH Steam Runtime from scout into %r',
                 self.unpack_ld_library_path)
             self.download_scout_tarball(scout)
-        elif self.unpack_ld_library_path:
-            assert pressure_vessel_runtime is not None
+        else:
             logger.info(
                 'Downloading LD_LIBRARY_PATH Steam Runtime from same place '
                 'as pressure-vessel into %r',
                 self.unpack_ld_library_path)
             self.download_scout_tarball(pressure_vessel_runtime)
 
+    def populate_runtime(self) -> None:
         if self.unpack_sources:
             logger.info(
                 'Will download %s source code into %r',
@@ -1006,16 +1876,15 @@ class Main:
                 version = runtime.pinned_version or ''
                 assert version
 
+            # These are all distinct, so there is no need for a set
             if self.include_archives:
-                runtime_files = set(
-                    runtime.get_archives(
-                        include_sdk_debug=self.include_sdk_debug,
-                        include_sdk_runtime=self.include_sdk_runtime,
-                        include_sdk_sysroot=self.include_sdk_sysroot,
-                    )
-                )
+                runtime_files = runtime.get_archives(
+                    include_sdk_debug=self.include_sdk_debug,
+                    include_sdk_runtime=self.include_sdk_runtime,
+                    include_sdk_sysroot=self.include_sdk_sysroot,
+                )   # type: List[str]
             else:
-                runtime_files = set()
+                runtime_files = []
 
             if self.unpack_runtime:
                 if self.versioned_directories:
@@ -1024,155 +1893,80 @@ class Main:
                     subdir = runtime.name
 
                 dest = os.path.join(self.depot, subdir)
-                runtime_files.add(subdir + '/')
-
-                with suppress(FileNotFoundError):
-                    shutil.rmtree(dest)
-
-                os.makedirs(dest, exist_ok=True)
-                argv = [
-                    'tar',
-                    '-C', dest,
-                    '-xf',
-                    os.path.join(self.cache, runtime.tarball),
-                ]
-                logger.info('%r', argv)
-                subprocess.run(argv, check=True)
-                self.prune_runtime(Path(dest))
-                self.write_lookaside(dest)
+                runtime_files.append(subdir + '/')
 
-                if self.minimize:
-                    self.minimize_runtime(dest)
-
-                self.ensure_ref(dest)
-
-                if self.include_sdk_runtime:
-                    if self.versioned_directories:
-                        sdk_subdir = '{}_sdk_{}'.format(runtime.name, version)
-                    else:
-                        sdk_subdir = '{}_sdk'.format(runtime.name)
+                # The platform, SDK and sysroot are unpacked into
+                # separate directories, so they can be done in parallel
+                with ThreadPoolExecutor(max_workers=3) as executor:
+                    futures = [
+                        executor.submit(self.unpack_platform, runtime, dest),
+                    ]
 
-                    dest = os.path.join(self.depot, sdk_subdir)
-                    runtime_files.add(sdk_subdir + '/')
+                    if self.include_sdk_runtime:
+                        if self.versioned_directories:
+                            sdk_subdir = '{}_sdk_{}'.format(
+                                runtime.name, version,
+                            )
+                        else:
+                            sdk_subdir = '{}_sdk'.format(runtime.name)
 
-                    with suppress(FileNotFoundError):
-                        shutil.rmtree(os.path.join(dest, 'files'))
+                        dest = os.path.join(self.depot, sdk_subdir)
+                        runtime_files.append(sdk_subdir + '/')
+                        futures.append(
+                            executor.submit(self.unpack_sdk, runtime, dest)
+                        )
 
-                    with suppress(FileNotFoundError):
-                        os.remove(os.path.join(dest, 'metadata'))
+                    if self.include_sdk_sysroot:
+                        if self.versioned_directories:
+                            sysroot_subdir = '{}_sysroot_{}'.format(
+                                runtime.name, version,
+                            )
+                        else:
+                            sysroot_subdir = '{}_sysroot'.format(
+                                runtime.name,
+                            )
 
-                    os.makedirs(
-                        os.path.join(dest, 'files', 'lib', 'debug'),
-                        exist_ok=True,
-                    )
-                    argv = [
-                        'tar',
-                        '-C', dest,
-                        '-xf', os.path.join(self.cache, runtime.sdk_tarball),
-                    ]
-                    logger.info('%r', argv)
-                    subprocess.run(argv, check=True)
-                    self.prune_runtime(Path(dest))
-                    self.write_lookaside(dest)
-
-                    if self.minimize:
-                        self.minimize_runtime(dest)
-
-                    self.ensure_ref(dest)
-
-                    if self.include_sdk_debug:
-                        argv = [
-                            'tar',
-                            '-C', os.path.join(dest, 'files', 'lib', 'debug'),
-                            '--transform', r's,^\(\./\)\?files\(/\|$\),,',
-                            '-xf',
-                            os.path.join(self.cache, runtime.debug_tarball),
-                        ]
-                        logger.info('%r', argv)
-                        subprocess.run(argv, check=True)
-
-                if self.include_sdk_sysroot:
-                    if self.versioned_directories:
-                        sysroot_subdir = '{}_sysroot_{}'.format(
-                            runtime.name, version,
+                        sysroot = os.path.join(self.depot, sysroot_subdir)
+                        runtime_files.append(sysroot_subdir + '/')
+                        futures.append(
+                            executor.submit(
+                                self.unpack_sysroot, runtime, sysroot,
+                            )
                         )
-                    else:
-                        sysroot_subdir = '{}_sysroot'.format(runtime.name)
-
-                    sysroot = os.path.join(self.depot, sysroot_subdir)
-                    runtime_files.add(sysroot_subdir + '/')
 
-                    with suppress(FileNotFoundError):
-                        shutil.rmtree(sysroot)
+                    for future in futures:
+                        future.result()
 
-                    os.makedirs(os.path.join(sysroot, 'files'), exist_ok=True)
+                # This needs both the sysroot and the detached debug
+                # symbols to have been unpacked
+                if self.include_sdk_sysroot and self.include_sdk_debug:
                     argv = [
-                        'tar',
-                        '-C', os.path.join(sysroot, 'files'),
-                        '--exclude', 'dev/*',
-                        '-xf',
-                        os.path.join(self.cache, runtime.sysroot_tarball),
+                        'cp',
+                        '-al',
+                        os.path.join(dest, 'files', 'lib', 'debug'),
+                        os.path.join(sysroot, 'files', 'usr', 'lib'),
                     ]
                     logger.info('%r', argv)
                     subprocess.run(argv, check=True)
 
-                    os.makedirs(
-                        os.path.join(
-                            sysroot, 'files', 'usr', 'lib', 'debug',
-                        ),
-                        exist_ok=True,
-                    )
-
-                    if self.include_sdk_debug:
-                        if self.include_sdk_sysroot:
-                            argv = [
-                                'cp',
-                                '-al',
-                                os.path.join(dest, 'files', 'lib', 'debug'),
-                                os.path.join(sysroot, 'files', 'usr', 'lib'),
-                            ]
-                            logger.info('%r', argv)
-                            subprocess.run(argv, check=True)
-                        else:
-                            argv = [
-                                'tar',
-                                '-C', os.path.join(
-                                    sysroot, 'files', 'usr', 'lib', 'debug'
-                                ),
-                                '--transform', r's,^\(\./\)\?files\(/\|$\),,',
-                                '-xf',
-                                os.path.join(
-                                    self.cache, runtime.debug_tarball,
-                                ),
-                            ]
-                            logger.info('%r', argv)
-                            subprocess.run(argv, check=True)
+            if self.unpack_runtime:
+                run_in_source = RUN_IN_DIR_SOURCE.format(
+                    escaped_dir=shlex.quote(subdir),
+                    source_for_generated_file='Generated file, do not edit',
+                )
+            else:
+                run_in_source = RUN_IN_ARCHIVE_SOURCE.format(
+                    escaped_arch=shlex.quote(runtime.architecture),
+                    escaped_name=shlex.quote(runtime.name),
+                    escaped_runtime=shlex.quote(runtime.platform),
+                    escaped_suite=shlex.quote(runtime.suite),
+                    source_for_generated_file='Generated file, do not edit',
+                )
 
-            with open(
-                os.path.join(self.depot, 'run-in-' + runtime.name), 'w'
-            ) as writer:
-                if self.unpack_runtime:
-                    writer.write(
-                        RUN_IN_DIR_SOURCE.format(
-                            escaped_dir=shlex.quote(subdir),
-                            source_for_generated_file=(
-                                'Generated file, do not edit'
-                            ),
-                        )
-                    )
-                else:
-                    writer.write(
-                        RUN_IN_ARCHIVE_SOURCE.format(
-                            escaped_arch=shlex.quote(runtime.architecture),
-                            escaped_name=shlex.quote(runtime.name),
-                            escaped_runtime=shlex.quote(runtime.platform),
-                            escaped_suite=shlex.quote(runtime.suite),
-                            source_for_generated_file=(
-                                'Generated file, do not edit'
-                            ),
-                        )
-                    )
-            os.chmod(os.path.join(self.depot, 'run-in-' + runtime.name), 0o755)
+            write_executable(
+                os.path.join(self.depot, 'run-in-' + runtime.name),
+                run_in_source,
+            )
 
             comment = ', '.join(sorted(runtime_files))
 
@@ -1217,15 +2011,11 @@ class Main:
 
                 vdf.dump(content, writer, pretty=True, escaped=True)
 
-            shutil.copy2(
-                os.path.join(self.depot, 'run-in-' + runtime.name),
-                os.path.join(self.depot, 'run'),
-            )
-            os.chmod(os.path.join(self.depot, 'run'), 0o755)
-
-        self.write_component_versions()
+            # We still have the contents in memory, so there's no need
+            # to copy run-in-* from disk
+            write_executable(os.path.join(self.depot, 'run'), run_in_source)
 
-    def write_component_versions(self) -> None:
+    def describe_git_version(self) -> str:
         try:
             with subprocess.Popen(
                 [
@@ -1240,20 +2030,26 @@ class Main:
             ) as describe:
                 stdout = describe.stdout
                 assert stdout is not None
-                version = stdout.read().strip()
                 # Deliberately ignoring exit status:
                 # if git is missing or old we'll use 'unknown'
+                return stdout.read().strip()
         except (OSError, subprocess.SubprocessError):
-            version = ''
+            return ''
 
-        try:
-            with open(HERE / '.tarball-version', 'r') as reader:
-                version = reader.read().strip()
-        except OSError:
-            pass
+    def write_component_versions(self) -> None:
+        version = self.scripts_version
+
+        if not version:
+            try:
+                with open(HERE / '.tarball-version', 'r') as reader:
+                    version = reader.read().strip()
+            except OSError:
+                pass
 
-        if self.scripts_version:
-            version = self.scripts_version
+        # Only ask git if the version was not given or recorded in a
+        # release tarball, since it would be overridden anyway
+        if not version:
+            version = self.describe_git_version()
 
         if self.depot_version:
             component_version = ComponentVersion('depot', sort_weight=-1)
@@ -1271,9 +2067,14 @@ class Main:
                 '#Name\tVersion\t\tRuntime\tRuntime_Version\tComment\n'
             )
 
-            for entry in sorted(self.versions, key=lambda v: v.to_sort_key()):
+            # The sort key ends with the line we want to write, so keep
+            # it rather than formatting each entry a second time
+            keyed = [(entry.to_sort_key(), entry) for entry in self.versions]
+            keyed.sort(key=lambda pair: pair[0])
+
+            for (_, tsv), entry in keyed:
                 logger.info('Component version: %s', entry)
-                writer.write(entry.to_tsv())
+                writer.write(tsv)
 
     def use_local_pressure_vessel(self, path: str = '.') -> None:
         pv_dir = os.path.join(self.depot, 'pressure-vessel')
@@ -1295,23 +2096,37 @@ class Main:
         pv = PressureVesselRelease(
             cache=self.cache,
             ssh_host=self.pressure_vessel_ssh_host,
+            ssh_options=self.ssh_options,
             ssh_path=self.pressure_vessel_ssh_path,
             uri=self.pressure_vessel_uri,
             version=version,
         )
-        pinned = pv.pin_version(self.opener)
-        self.use_local_pressure_vessel(
-            pv.fetch('pressure-vessel-bin.tar.gz', self.opener, pinned)
-        )
+        filename = 'pressure-vessel-bin.tar.gz'
+
+        if version == 'latest':
+            pinned = pv.pin_version(self.get_opener())
+            downloaded = pv.fetch(filename, self.get_opener(), pinned)
+        else:
+            # We already know which directory to download from, so
+            # there's no need to wait for VERSION.txt before starting
+            # the larger download
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                future = executor.submit(
+                    lambda: pv.fetch(filename, self.get_opener(), version)
+                )
+                pinned = pv.pin_version(self.get_opener())
+                downloaded = future.result()
+
+        self.use_local_pressure_vessel(downloaded)
         return pinned
 
     def download_pressure_vessel_from_runtime(self, runtime: Runtime) -> str:
         filename = 'pressure-vessel-bin.tar.gz'
-        runtime.pin_version(self.opener)
+        runtime.pin_version(self.get_opener())
 
         downloaded = runtime.fetch(
             filename,
-            self.opener,
+            self.get_opener(),
         )
 
         os.makedirs(self.depot, exist_ok=True)
@@ -1324,6 +2139,120 @@ class Main:
 
         return filename
 
+    def can_stream_archives(self, runtime: Runtime) -> bool:
+        '''
+        Return True if runtime's archives can be extracted while they
+        are being downloaded, instead of downloading them first.
+
+        This is only done for HTTP downloads, and only if the archives
+        themselves are not going to be included in the depot.
+        '''
+        return (
+            not runtime.path
+            and not (runtime.ssh_host and runtime.ssh_path)
+            and not self.include_archives
+        )
+
+    def extract_archive(
+        self,
+        runtime: Runtime,
+        basename: str,
+        argv: List[str],
+    ) -> None:
+        '''
+        Extract basename from runtime, by running argv (a tar command
+        with options but no -f) on it.
+
+        If it has not already been downloaded and can_stream_archives()
+        allows it, it is downloaded into the cache and piped into tar
+        at the same time, so that we do not have to wait for the
+        download to finish and then read it all back from disk.
+        '''
+        if (
+            not self.can_stream_archives(runtime)
+            or runtime.is_cached(basename)
+        ):
+            argv = argv + ['-xf', os.path.join(self.cache, basename)]
+            logger.info('%r', argv)
+            subprocess.run(argv, check=True)
+            return
+
+        # tar cannot detect the compression format when reading a pipe
+        if basename.endswith('.gz'):
+            argv = argv + ['-z']
+
+        argv = argv + ['-xf', '-']
+        logger.info('%r < %r', argv, runtime.get_uri(basename))
+
+        with subprocess.Popen(argv, stdin=subprocess.PIPE) as tar:
+            assert tar.stdin is not None
+
+            try:
+                runtime.fetch(basename, self.get_opener(), tee=tar.stdin)
+            except BrokenPipeError:
+                # tar exited early: report that, below
+                pass
+            finally:
+                with suppress(BrokenPipeError):
+                    tar.stdin.close()
+
+        if tar.returncode != 0:
+            raise subprocess.CalledProcessError(tar.returncode, argv)
+
+    def unpack_platform(self, runtime: Runtime, dest: str) -> None:
+        rm_rf(dest)
+        os.makedirs(dest, exist_ok=True)
+        self.extract_archive(runtime, runtime.tarball, ['tar', '-C', dest])
+        self.prune_runtime(Path(dest))
+        self.write_lookaside(dest)
+
+        if self.minimize:
+            self.minimize_runtime(dest)
+
+        self.ensure_ref(dest)
+
+    def unpack_sdk(self, runtime: Runtime, dest: str) -> None:
+        rm_rf(os.path.join(dest, 'files'))
+
+        with suppress(FileNotFoundError):
+            os.remove(os.path.join(dest, 'metadata'))
+
+        os.makedirs(
+            os.path.join(dest, 'files', 'lib', 'debug'),
+            exist_ok=True,
+        )
+        self.extract_archive(
+            runtime, runtime.sdk_tarball, ['tar', '-C', dest],
+        )
+        self.prune_runtime(Path(dest))
+        self.write_lookaside(dest)
+
+        if self.minimize:
+            self.minimize_runtime(dest)
+
+        self.ensure_ref(dest)
+
+        if self.include_sdk_debug:
+            self.extract_archive(runtime, runtime.debug_tarball, [
+                'tar',
+                '-C', os.path.join(dest, 'files', 'lib', 'debug'),
+                '--transform', r's,^\(\./\)\?files\(/\|$\),,',
+            ])
+
+    def unpack_sysroot(self, runtime: Runtime, sysroot: str) -> None:
+        rm_rf(sysroot)
+        os.makedirs(os.path.join(sysroot, 'files'), exist_ok=True)
+        self.extract_archive(runtime, runtime.sysroot_tarball, [
+            'tar',
+            '-C', os.path.join(sysroot, 'files'),
+            '--exclude', 'dev/*',
+        ])
+
+        os.makedirs(
+            os.path.join(sysroot, 'files', 'usr', 'lib', 'debug'),
+            exist_ok=True,
+        )
+
     def use_local_runtime(self, runtime: Runtime) -> None:
         assert runtime.path
 
@@ -1336,19 +2265,13 @@ class Main:
             dest = os.path.join(self.cache, basename)
             logger.info('Hard-linking local runtime %r to %r', src, dest)
 
-            with suppress(FileNotFoundError):
-                os.unlink(dest)
-
-            os.link(src, dest)
+            link_replacing(src, dest)
 
             if self.include_archives:
                 dest = os.path.join(self.depot, basename)
                 logger.info('Hard-linking local runtime %r to %r', src, dest)
 
-                with suppress(FileNotFoundError):
-                    os.unlink(dest)
-
-                os.link(src, dest)
+                link_replacing(src, dest)
 
         if self.include_archives:
             with open(
@@ -1363,6 +2286,9 @@ class Main:
                     writer.write(f'{runtime.version}\n')
 
         if self.unpack_sources:
+            # Only imported when needed, because it's slow to import
+            from debian.deb822 import Sources
+
             with open(
                 os.path.join(runtime.path, runtime.sources), 'rb',
             ) as reader:
@@ -1381,9 +2307,8 @@ class Main:
                                     stanza['package'],
                                 )
 
-                                with suppress(FileNotFoundError):
-                                    logger.info('Removing %r', dest)
-                                    shutil.rmtree(dest)
+                                logger.info('Removing %r', dest)
+                                rm_rf(dest)
 
                                 subprocess.run(
                                     [
@@ -1405,22 +2330,39 @@ class Main:
         runtime build.
         """
 
-        pinned = runtime.pin_version(self.opener)
-
-        for basename in runtime.get_archives(
+        pinned = runtime.pin_version(self.get_opener())
+        archives = runtime.get_archives(
             include_sdk_debug=self.include_sdk_debug,
             include_sdk_runtime=self.include_sdk_runtime,
             include_sdk_sysroot=self.include_sdk_sysroot,
-        ):
-            downloaded = runtime.fetch(basename, self.opener)
+        )
+
+        if self.can_stream_archives(runtime):
+            # The tarballs will be downloaded while they are extracted
+            streamed = {
+                runtime.tarball,
+                runtime.debug_tarball,
+                runtime.sdk_tarball,
+                runtime.sysroot_tarball,
+            }
+            wanted = [a for a in archives if a not in streamed]
+        else:
+            wanted = list(archives)
+
+        if self.unpack_sources:
+            # Download the sources index alongside the archives, rather
+            # than waiting for them to finish before starting on it
+            downloads = self.fetch_many(runtime, wanted + [runtime.sources])
+        else:
+            downloads = self.fetch_many(runtime, wanted)
+
+        for basename in wanted:
+            downloaded = downloads[basename]
 
             if self.include_archives:
                 dest = os.path.join(self.depot, basename)
 
-                with suppress(FileNotFoundError):
-                    os.unlink(dest)
-
-                os.link(downloaded, dest)
+                link_replacing(downloaded, dest)
 
         if self.include_archives:
             with open(
@@ -1435,13 +2377,13 @@ class Main:
                     writer.write(f'{pinned}\n')
 
         if self.unpack_sources:
+            # Only imported when needed, because it's slow to import
+            from debian.deb822 import Sources
+
             with tempfile.TemporaryDirectory(prefix='populate-depot.') as tmp:
                 want = set(self.unpack_sources)
-                downloaded = runtime.fetch(
-                    runtime.sources,
-                    self.opener,
-                )
-                with open(downloaded, 'rb') as reader:
+
+                with open(downloads[runtime.sources], 'rb') as reader:
                     for stanza in Sources.iter_paragraphs(
                         sequence=reader,
                         use_apt_pkg=True,
@@ -1459,12 +2401,14 @@ class Main:
 
                             file_path = {}    # type: Dict[str, str]
 
-                            for f in stanza['files']:
-                                name = f['name']
-                                file_path[name] = runtime.fetch(
-                                    os.path.join('sources', name),
-                                    self.opener,
-                                )
+                            for path, local_path in self.fetch_many(
+                                runtime,
+                                [
+                                    os.path.join('sources', f['name'])
+                                    for f in stanza['files']
+                                ],
+                            ).items():
+                                file_path[os.path.basename(path)] = local_path
 
                             for f in stanza['files']:
                                 name = f['name']
@@ -1476,9 +2420,8 @@ class Main:
                                         stanza['package'],
                                     )
 
-                                    with suppress(FileNotFoundError):
-                                        logger.info('Removing %r', dest)
-                                        shutil.rmtree(dest)
+                                    logger.info('Removing %r', dest)
+                                    rm_rf(dest)
 
                                     subprocess.run(
                                         [
@@ -1503,13 +2446,13 @@ class Main:
         """
         filename = 'steam-runtime.tar.xz'
 
-        pinned = runtime.pin_version(self.opener)
+        pinned = runtime.pin_version(self.get_opener())
         logger.info('Downloading steam-runtime build %s', pinned)
         os.makedirs(self.unpack_ld_library_path, exist_ok=True)
 
         downloaded = runtime.fetch(
             filename,
-            self.opener,
+            self.get_opener(),
         )
         subprocess.run(
             [
@@ -1519,70 +2462,100 @@ class Main:
             check=True,
         )
 
-    def octal_escape_char(self, match: 're.Match') -> str:
-        ret = []    # type: List[str]
-
-        for byte in match.group(0).encode('utf-8', 'surrogateescape'):
-            ret.append('\\%03o' % byte)
+    _OCTAL_ESCAPES = ['\\%03o' % byte for byte in range(256)]
 
-        return ''.join(ret)
+    def octal_escape_char(self, match: 're.Match') -> str:
+        return ''.join(
+            map(
+                self._OCTAL_ESCAPES.__getitem__,
+                match.group(0).encode('utf-8', 'surrogateescape'),
+            )
+        )
 
-    _NEEDS_OCTAL_ESCAPE = re.compile(r'[^-A-Za-z0-9+,./:@_]')
+    # Match runs of characters rather than single characters, so that
+    # a name with several of them only needs one callback per run
+    _NEEDS_OCTAL_ESCAPE = re.compile(r'[^-A-Za-z0-9+,./:@_]+')
 
     def octal_escape(self, s: str) -> str:
-        return self._NEEDS_OCTAL_ESCAPE.sub(self.octal_escape_char, s)
+        # Most names need no escaping, and search() is cheaper than sub()
+        if self._NEEDS_OCTAL_ESCAPE.search(s) is None:
+            return s
 
-    def filename_is_windows_friendly(self, s: str) -> bool:
-        for c in s:
-            # This is the set of characters that are reserved in Windows
-            # filenames, excluding '/' which obviously we're fine with
-            # using as a directory separator.
-            if c in r'<>:"\|?*':
-                return False
+        return self._NEEDS_OCTAL_ESCAPE.sub(self.octal_escape_char, s)
 
-            if c >= '\uDC80' and c <= '\uDCFF':
-                # surrogate escape, not Unicode
-                return False
+    # This is the set of characters that are reserved in Windows
+    # filenames, excluding '/' which obviously we're fine with
+    # using as a directory separator, plus surrogate escapes (which
+    # are not Unicode).
+    _NOT_WINDOWS_FRIENDLY = re.compile(r'[<>:"\\|?*\uDC80-\uDCFF]')
 
-        return True
+    def filename_is_windows_friendly(self, s: str) -> bool:
+        return self._NOT_WINDOWS_FRIENDLY.search(s) is None
 
     def write_lookaside(self, runtime: str) -> None:
         with tempfile.TemporaryDirectory(prefix='slr-mtree-') as temp:
             lc_names = {}                   # type: Dict[str, str]
             differ_only_by_case = set()     # type: Set[str]
             not_windows_friendly = set()    # type: Set[str]
-            sha256 = {}                     # type: Dict[Tuple[int, int], str]
             paths = {}                      # type: Dict[Tuple[int, int], str]
+            # (path, path relative to runtime, name, stat result)
+            members = []    # type: List[Tuple[str, str, str, Any]]
+            to_hash = {}                    # type: Dict[Tuple[int, int], str]
+            top = os.path.join(runtime, 'files')
+            members.append((top, 'files', '.', os.lstat(top)))
+
+            # First list the files, so that we can hash them in parallel:
+            # hashlib releases the GIL while hashing large buffers
+            for entry in scandir_recursive(top):
+                member = entry.path
+                name = member[len(top) + 1:]
+                relative_path = 'files/' + name
+                # This is usually cached by os.scandir()
+                stat_info = entry.stat(follow_symlinks=False)
+                members.append((member, relative_path, name, stat_info))
+
+                if stat.S_ISREG(stat_info.st_mode) and stat_info.st_size > 0:
+                    # Hard links only need hashing once
+                    file_id = (stat_info.st_dev, stat_info.st_ino)
+                    to_hash.setdefault(file_id, member)
 
-            writer = gzip.open(os.path.join(temp, 'usr-mtree.txt.gz'), 'wt')
+            with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+                sha256 = dict(
+                    zip(to_hash, executor.map(sha256_file, to_hash.values()))
+                )   # type: Dict[Tuple[int, int], str]
 
+            # Build up the manifest in memory and compress it in one go,
+            # which is a lot faster than a gzip.write() per line
+            writer = io.StringIO()
             writer.write('#mtree\n')
             writer.write('. type=dir\n')
 
-            for member in Path(runtime).rglob("*"):
-                relative_path = member.relative_to(runtime)
-
-                try:
-                    name = str(relative_path.relative_to('files'))
-                except ValueError:
-                    continue
-
-                if not self.filename_is_windows_friendly(name):
+            # This loop runs once per file, so look up attributes and
+            # methods once, outside it
+            octal_escape = self.octal_escape
+            is_windows_friendly = self.filename_is_windows_friendly
+            write = writer.write
+            S_ISREG = stat.S_ISREG
+            S_ISLNK = stat.S_ISLNK
+            S_ISDIR = stat.S_ISDIR
+
+            for member, relative_path, name, stat_info in members:
+                if not is_windows_friendly(name):
                     not_windows_friendly.add(name)
 
-                if name.lower() in lc_names:
-                    differ_only_by_case.add(lc_names[name.lower()])
+                lc_name = name.lower()
+
+                if lc_name in lc_names:
+                    differ_only_by_case.add(lc_names[lc_name])
                     differ_only_by_case.add(name)
                 else:
-                    lc_names[name.lower()] = name
+                    lc_names[lc_name] = name
 
-                fields = ['./' + self.octal_escape(name)]
+                escaped = octal_escape(name)
+                mode = stat_info.st_mode
 
-                stat_info = os.lstat(member)
-
-                if stat.S_ISREG(stat_info.st_mode):
-                    fields.append('type=file')
-                    fields.append('mode=%o' % stat_info.st_mode)
+                if S_ISREG(mode):
+                    size = stat_info.st_size
 
                     # With sub-second precision, note that some versions
                     # of mtree use the part after the dot as integer
@@ -1590,51 +2563,33 @@ class Main:
                     # or what normal people would write as 1.000000234.
                     # To be compatible with both, we always show the time
                     # with 9 digits after the decimal point.
-                    fields.append(f'time={stat_info.st_mtime:.9f}')
-
-                    fields.append(f'size={stat_info.st_size}')
+                    line = (
+                        f'./{escaped} type=file mode={mode:o} '
+                        f'time={stat_info.st_mtime:.9f} size={size}'
+                    )
                     file_id = (stat_info.st_dev, stat_info.st_ino)
-                    if stat_info.st_size > 0:
-                        if file_id not in sha256:
-                            hasher = hashlib.sha256()
-                            with open(member, 'rb') as f:
-                                while True:
-                                    blob = f.read(4096)
-
-                                    if not blob:
-                                        break
 
-                                    hasher.update(blob)
-
-                            sha256[file_id] = hasher.hexdigest()
-
-                        fields.append(f'sha256={sha256[file_id]}')
+                    if size > 0:
+                        line += f' sha256={sha256[file_id]}'
 
                     if stat_info.st_nlink > 1:
                         if file_id in paths:
-                            writer.write(
+                            write(
                                 '# hard link to {}\n'.format(
-                                    self.octal_escape(paths[file_id]),
+                                    octal_escape(paths[file_id]),
                                 ),
                             )
                         else:
-                            paths[file_id] = str(relative_path)
-
-                elif stat.S_ISLNK(stat_info.st_mode):
-                    fields.append('type=link')
-                    fields.append(
-                        f'link={self.octal_escape(os.readlink(member))}')
-                elif stat.S_ISDIR(stat_info.st_mode):
-                    fields.append('type=dir')
+                            paths[file_id] = relative_path
+
+                    write(line + '\n')
+                elif S_ISLNK(mode):
+                    target = octal_escape(os.readlink(member))
+                    write(f'./{escaped} type=link link={target}\n')
+                elif S_ISDIR(mode):
+                    write(f'./{escaped} type=dir\n')
                 else:
-                    writer.write(
-                        '# unknown file type: {}\n'.format(
-                            self.octal_escape(name),
-                        ),
-                    )
-                    continue
-
-                writer.write(' '.join(fields) + '\n')
+                    write(f'# unknown file type: {escaped}\n')
 
             if '.ref' not in lc_names:
                 writer.write('./.ref type=file size=0 mode=644\n')
@@ -1653,42 +2608,36 @@ class Main:
                 for name in sorted(not_windows_friendly):
                     writer.write('# {}\n'.format(self.octal_escape(name)))
 
-            # We need to close the gzip before copying it, otherwise we
-            # will end up with a corrupted file
-            writer.close()
-            shutil.copy2(writer.name, runtime)
+            mtree = os.path.join(temp, 'usr-mtree.txt.gz')
+
+            with gzip.open(mtree, 'wb') as gzip_writer:
+                gzip_writer.write(writer.getvalue().encode('utf-8'))
+
+            shutil.copy2(mtree, runtime)
 
     def minimize_runtime(self, root: str) -> None:
         '''
         Remove files that pressure-vessel can reconstitute from the manifest.
 
-        This is the equivalent of:
+        This is done with:
 
         find $root/files -type l -delete
         find $root/files -empty -delete
 
+        combined into a single find(1) process. -delete implies -depth,
+        so directories that only become empty after their contents are
+        deleted are deleted too.
+
         Note that this needs to be done before ensure_ref(), otherwise
         it will delete files/.ref too.
         '''
-        for (dirpath, dirnames, filenames) in os.walk(
-            os.path.join(root, 'files'),
-            topdown=False,
-        ):
-            for f in filenames + dirnames:
-                path = os.path.join(dirpath, f)
-
-                try:
-                    statinfo = os.lstat(path)
-                except FileNotFoundError:
-                    continue
-
-                if stat.S_ISLNK(statinfo.st_mode) or statinfo.st_size == 0:
-                    os.remove(path)
-            try:
-                os.rmdir(dirpath)
-            except OSError as e:
-                if e.errno != errno.ENOTEMPTY:
-                    raise
+        argv = [
+            'find', os.path.join(root, 'files'),
+            '(', '-type', 'l', '-o', '-empty', ')',
+            '-delete',
+        ]
+        logger.info('%r', argv)
+        subprocess.run(argv, check=True)
 
 
 def main() -> None:
@@ -1755,7 +2704,8 @@ def main() -> None:
         metavar='URI',
         help=(
             'Download files from the given URI. '
-            '"SUITE" will be replaced with the suite name.'
+            '"SUITE" will be replaced with the suite name. '
+            'A comma-separated list of mirrors can be given.'
         ),
     )
 
@@ -1795,7 +2745,8 @@ def main() -> None:
         default=DEFAULT_PRESSURE_VESSEL_URI,
         metavar='URI',
         help=(
-            'Download pressure-vessel from a versioned subdirectory of URI'
+            'Download pressure-vessel from a versioned subdirectory of URI. '
+            'A comma-separated list of mirrors can be given.'
         ),
     )
     parser.add_argument(
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# Copyright 2023 Collabora Ltd.
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Check populate-depot.py's HTTP downloads against a local server:
+pinning the version of several runtimes at the same time without their
+cache files getting in each other's way, and resuming interrupted
+downloads.
+"""
+
+import hashlib
+import http.server
+import importlib.util
+import logging
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import typing
+    typing      # placate pyflakes
+except ImportError:
+    pass
+
+
+logger = logging.getLogger('test-pin-version')
+
+SHA256 = 'a' * 64
+OTHER_SHA256 = 'b' * 64
+
+
+def load_populate_depot():
+    # type: () -> typing.Any
+    spec = importlib.util.spec_from_file_location(
+        'populate_depot',
+        os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            'populate-depot.py',
+        ),
+    )
+    assert spec is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)     # type: ignore
+    return module
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    files = {}      # type: typing.Dict[str, bytes]
+    # If false, behave like a server that does not support Range
+    honour_range = True
+    # The path and Range header of each request
+    requests = []   # type: typing.List[typing.Tuple[str, str]]
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        assert isinstance(self.server, Server)
+        body = self.server.files.get(self.path)
+        range_header = self.headers.get('Range', '')
+        self.server.requests.append((self.path, range_header))
+
+        if body is None:
+            self.send_error(404)
+            return
+
+        if self.server.honour_range and range_header.startswith('bytes='):
+            start = int(range_header[len('bytes='):].rstrip('-'))
+
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(body)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            self.send_response(206)
+            self.send_header(
+                'Content-Range',
+                f'bytes {start}-{len(body) - 1}/{len(body)}',
+            )
+            body = body[start:]
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Length', str(len(body)))
+        # Make read_version_txt() write its cache file
+        self.send_header('Last-Modified', 'Thu, 01 Jan 2015 00:00:00 GMT')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: typing.Any) -> None:
+        pass
+
+
+class ServerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.populate_depot = load_populate_depot()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+
+        self.server = server = Server(('127.0.0.1', 0), Handler)
+        server.requests = []
+        server.files = {
+            '/steamrt-images-scout/snapshots/latest/VERSION.txt': b'0.1\n',
+            '/steamrt-images-scout/snapshots/latest/SHA256SUMS': (
+                SHA256.encode('ascii') + b' *foo.tar.gz\n'
+            ),
+        }
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.images_uri = (
+            'http://127.0.0.1:{}/steamrt-images-SUITE/snapshots'.format(
+                server.server_address[1],
+            )
+        )
+
+
+class TestPinVersion(ServerTestCase):
+    def test_same_suite(self) -> None:
+        '''
+        Distinct Runtime objects for the same suite, for example the
+        main runtime and the one used for pressure-vessel, share
+        cache files but not a lock.
+        '''
+        opener = urllib.request.build_opener()
+
+        for i in range(20):
+            cache = os.path.join(self.tmpdir, 'cache{}'.format(i))
+            runtimes = [
+                self.populate_depot.Runtime(
+                    'scout',
+                    suite='scout',
+                    cache=cache,
+                    images_uri=self.images_uri,
+                )
+                for _ in range(4)
+            ]
+
+            with ThreadPoolExecutor(len(runtimes)) as executor:
+                pinned = list(executor.map(
+                    lambda runtime: runtime.pin_version(opener),
+                    runtimes,
+                ))
+
+            self.assertEqual(pinned, ['0.1'] * len(runtimes))
+
+            for runtime in runtimes:
+                self.assertEqual(runtime.sha256, {'foo.tar.gz': SHA256})
+
+            self.assertEqual(
+                sorted(os.listdir(cache)),
+                ['scout-0.1-sha256.json', 'scout-VERSION.json'],
+            )
+
+    def test_sha256sums(self) -> None:
+        '''
+        SHA256SUMS can be in text or binary (*) mode, and have Windows
+        line endings.
+        '''
+        self.server.files[
+            '/steamrt-images-scout/snapshots/latest/SHA256SUMS'
+        ] = (
+            SHA256.encode('ascii') + b' *foo.tar.gz\r\n'
+            + OTHER_SHA256.encode('ascii') + b'  bar baz.txt\r\n'
+        )
+        runtime = self.populate_depot.Runtime(
+            'scout',
+            suite='scout',
+            cache=os.path.join(self.tmpdir, 'cache'),
+            images_uri=self.images_uri,
+        )
+        runtime.pin_version(urllib.request.build_opener())
+        self.assertEqual(
+            runtime.sha256,
+            {'foo.tar.gz': SHA256, 'bar baz.txt': OTHER_SHA256},
+        )
+
+        with self.assertRaises(ValueError):
+            self.populate_depot.parse_sha256sums(b'garbage\n')
+
+
+class TestDownloadHttp(ServerTestCase):
+    path = '/steamrt-images-scout/snapshots/latest/foo.tar.gz'
+    body = bytes(range(256)) * 64
+    sha256 = hashlib.sha256(body).hexdigest()
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.server.files[self.path] = self.body
+        self.uri = 'http://127.0.0.1:{}{}'.format(
+            self.server.server_address[1], self.path,
+        )
+        self.dest = os.path.join(self.tmpdir, 'foo.tar.gz')
+        self.openers = [
+            urllib.request.build_opener(),
+        ]   # type: typing.List[urllib.request.OpenerDirector]
+
+        if self.populate_depot.have_requests():
+            self.openers.append(self.populate_depot.RequestsOpener({}))
+
+    def download(
+        self,
+        opener: urllib.request.OpenerDirector,
+        partial: typing.Optional[bytes],
+        sha256: typing.Optional[str] = None,
+    ) -> typing.List[str]:
+        '''
+        Download self.uri with dest.new already containing partial,
+        check the result, and return the Range headers that were sent.
+        '''
+        for path in (self.dest, self.dest + '.new', self.dest + '.sha256'):
+            if os.path.exists(path):
+                os.unlink(path)
+
+        if partial is not None:
+            with open(self.dest + '.new', 'wb') as writer:
+                writer.write(partial)
+
+        self.server.requests = []
+        self.populate_depot.download_http(
+            opener, self.uri, self.dest, sha256 or self.sha256,
+        )
+
+        with open(self.dest, 'rb') as reader:
+            self.assertEqual(reader.read(), self.body)
+
+        self.assertFalse(os.path.exists(self.dest + '.new'))
+        return [r for p, r in self.server.requests if p == self.path]
+
+    def test_no_partial(self) -> None:
+        for opener in self.openers:
+            self.assertEqual(self.download(opener, None), [''])
+
+    def test_resume(self) -> None:
+        for opener in self.openers:
+            self.assertEqual(
+                self.download(opener, self.body[:1000]),
+                ['bytes=1000-'],
+            )
+
+    def test_range_ignored(self) -> None:
+        '''
+        If the server sends the whole file with status 200, the
+        partial download must be overwritten, not appended to.
+        '''
+        self.server.honour_range = False
+
+        for opener in self.openers:
+            self.assertEqual(
+                self.download(opener, self.body[:1000]),
+                ['bytes=1000-'],
+            )
+
+    def test_range_not_satisfiable(self) -> None:
+        '''
+        If the partial download is already too long, the server says
+        416 Range Not Satisfiable and we start again.
+        '''
+        for opener in self.openers:
+            self.assertEqual(
+                self.download(opener, self.body + b'extra'),
+                ['bytes={}-'.format(len(self.body) + 5), ''],
+            )
+
+    def test_corrupt_partial(self) -> None:
+        '''
+        If the resumed download doesn't match the checksum, the
+        partial download is discarded and we start again.
+        '''
+        for opener in self.openers:
+            self.assertEqual(
+                self.download(opener, b'x' * 1000),
+                ['bytes=1000-', ''],
+            )
+
+    def test_no_checksum(self) -> None:
+        '''
+        Without a checksum to verify the result, don't resume.
+        '''
+        for opener in self.openers:
+            with open(self.dest + '.new', 'wb') as writer:
+                writer.write(b'x' * 1000)
+
+            self.server.requests = []
+            self.populate_depot.download_http(opener, self.uri, self.dest)
+
+            with open(self.dest, 'rb') as reader:
+                self.assertEqual(reader.read(), self.body)
+
+            self.assertEqual(self.server.requests, [(self.path, '')])
+
+    def test_wrong_checksum(self) -> None:
+        for opener in self.openers:
+            with self.assertRaises(RuntimeError):
+                self.download(opener, None, sha256=OTHER_SHA256)
+
+            self.assertFalse(os.path.exists(self.dest))
+            self.assertFalse(os.path.exists(self.dest + '.new'))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG)
+
+    sys.path[:0] = [os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        'third-party',
+    )]
+
+    import pycotap
+    unittest.main(
+        buffer=False,
+        testRunner=pycotap.TAPTestRunner,
+    )
+
+# vi: set sw=4 sts=4 et:
@@ -0,0 +1,12 @@
+#!/bin/sh
+# Copyright © 2023 Collabora Ltd.
+# SPDX-License-Identifier: MIT
+
+set -eu
+
+if [ -n "${TESTS_ONLY-}" ]; then
+    echo "1..0 # SKIP This distro is too old to run populate-depot.py"
+    exit 0
+fi
+
+exec python3 tests/pin-version.py
@@ -9,7 +9,7 @@ set -eu
 set --
 
 if [ -z "${TESTS_ONLY-}" ]; then
-    set -- "$@" ./*.py
+    set -- "$@" ./*.py tests/*.py
 fi
 
 set -- "$@" tests/depot/*.py
@@ -12,7 +12,7 @@ fail=
 set --
 
 if [ -z "${TESTS_ONLY-}" ]; then
-    set -- "$@" ./*.py
+    set -- "$@" ./*.py tests/*.py
 fi
 
 set -- "$@" tests/depot/*.py
@@ -3,6 +3,7 @@
 #
 # SPDX-License-Identifier: MIT
 
+import filecmp
 import os
 import subprocess
 import sys
@@ -34,47 +35,98 @@ class TestCheapCopy(BaseTest):
         subset,
         require_hard_links: bool = True,
     ):
-        for path, dirs, files in os.walk(subset):
-            equivalent = os.path.join(superset, os.path.relpath(path, subset))
-
-            for d in dirs:
-                in_subset = os.path.join(path, d)
-                in_superset = os.path.join(equivalent, d)
-
-                if not os.path.isdir(in_superset):
-                    raise AssertionError(
-                        '%r should be a directory', in_superset)
-
-                info = os.stat(in_subset)
-                info2 = os.stat(in_superset)
-                self.assertEqual(info.st_mode, info2.st_mode)
-
-            for f in files:
-                in_subset = os.path.join(path, f)
-                in_superset = os.path.join(equivalent, f)
-
-                if (
-                    os.path.islink(in_subset)
-                    or not os.path.exists(in_subset)
-                ):
-                    target = os.readlink(in_subset)
-                    target2 = os.readlink(in_superset)
-                    self.assertEqual(target, target2)
-                else:
-                    info = os.stat(in_subset)
-                    info2 = os.stat(in_superset)
-
-                    if require_hard_links:
-                        self.assertEqual(info.st_ino, info2.st_ino)
-                        self.assertEqual(info.st_dev, info2.st_dev)
-
-                    self.assertEqual(info.st_mode, info2.st_mode)
-                    self.assertEqual(info.st_size, info2.st_size)
-                    self.assertEqual(int(info.st_mtime), int(info2.st_mtime))
+        def file_key(info: os.stat_result) -> 'typing.Tuple[int, ...]':
+            if require_hard_links:
+                return (
+                    info.st_mode, info.st_size, int(info.st_mtime),
+                    info.st_ino, info.st_dev,
+                )
+
+            return (info.st_mode, info.st_size, int(info.st_mtime))
+
+        # Equivalent to os.walk(), but using the information that
+        # os.scandir() already has, instead of stat()ing each entry again
+        def walk(path: str, equivalent: str) -> None:
+            # Read each directory in the superset once, instead of
+            # looking up its entries one at a time
+            with os.scandir(equivalent) as entries:
+                others = {other.name: other for other in entries}
+
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    in_subset = entry.path
+                    other = others.get(entry.name)
+
+                    if other is None:
+                        raise AssertionError(
+                            '%r should exist',
+                            os.path.join(equivalent, entry.name))
+
+                    in_superset = other.path
+
+                    # Like os.walk(), this follows symlinks
+                    if entry.is_dir():
+                        if not other.is_dir():
+                            raise AssertionError(
+                                '%r should be a directory', in_superset)
+
+                        info = entry.stat()
+                        info2 = other.stat()
+                        self.assertEqual(info.st_mode, info2.st_mode)
+
+                        if not entry.is_symlink():
+                            walk(in_subset, in_superset)
+
+                    elif entry.is_symlink():
+                        target = os.readlink(in_subset)
+                        target2 = os.readlink(in_superset)
+                        self.assertEqual(target, target2)
+                    else:
+                        self.assertEqual(
+                            file_key(entry.stat(follow_symlinks=False)),
+                            file_key(other.stat()),
+                            in_subset,
+                        )
+
+                        # If they are not the same inode, check that the
+                        # copy has the same contents as well as metadata
+                        if not require_hard_links:
+                            self.assertTrue(
+                                filecmp.cmp(
+                                    in_subset, in_superset, shallow=False,
+                                ),
+                                in_subset,
+                            )
+
+        walk(subset, superset)
+
+    def list_tree(self, root: str) -> 'typing.Set[str]':
+        '''
+        Return the paths below root, relative to root, descending into
+        the same directories as assert_tree_is_superset().
+        '''
+        ret = set()     # type: typing.Set[str]
+        stack = ['']
+
+        while stack:
+            relative = stack.pop()
+
+            with os.scandir(os.path.join(root, relative)) as entries:
+                for entry in entries:
+                    path = os.path.join(relative, entry.name)
+                    ret.add(path)
+
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(path)
+
+        return ret
 
     def assert_tree_is_same(self, left, right, require_hard_links=True):
         self.assert_tree_is_superset(left, right, require_hard_links)
-        self.assert_tree_is_superset(right, left, require_hard_links)
+        # Every entry in right has now been compared with the
+        # corresponding entry in left, so the only other way they can
+        # differ is if left has entries that right does not
+        self.assertEqual(self.list_tree(left), self.list_tree(right))
 
     def test_empty(self) -> None:
         with tempfile.TemporaryDirectory(
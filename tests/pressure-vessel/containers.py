@@ -156,10 +156,22 @@ class TestContainers(BaseTest):
     pv_dir = ''
     pv_wrap = ''
 
+    @staticmethod
+    def link_or_copy2(src, dest):
+        # Nothing modifies these files after setUpClass(), so a hard
+        # link is as good as a copy, and much cheaper if the build
+        # directory is on the same filesystem as the temporary directory
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copy2(src, dest)
+
+        return dest
+
     @staticmethod
     def copy2(src, dest):
         logger.info('Copying %r to %r', src, dest)
-        shutil.copy2(src, dest)
+        TestContainers.link_or_copy2(src, dest)
 
     @classmethod
     def setUpClass(cls) -> None:
@@ -275,6 +287,7 @@ class TestContainers(BaseTest):
                     os.path.join(cls.top_builddir, d),
                     os.path.join(cls.pv_dir, d),
                     symlinks=True,
+                    copy_function=cls.link_or_copy2,
                 )
 
             # We need both i386 and x86_64 helper utilities